@@ -28,7 +28,6 @@ SOURCE_FOLDER = BASE_DIR / "dataset"
 
 # Output folder for RT-DETR compatible JSONs
 OUTPUT_FOLDER = BASE_DIR / "RTDETR"
-OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
 
 
 def fix_coco_ids(input_json_path, output_json_path):
@@ -76,6 +75,7 @@ def fix_coco_ids(input_json_path, output_json_path):
 def process_all_splits():
     """Apply ID normalization for train, val, test."""
     splits = ["train", "val", "test"]
+    OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
 
     for split in splits:
         input_path = SOURCE_FOLDER / split / f"{split}_ann.json"
@@ -48,11 +48,13 @@ def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 # STEP 0 — COPY train_ann.json / val_ann.json
-def copy_json(split):
+def copy_json(split, sampled_folder=None, final_folder=None):
     print(f"\n Copying JSON for {split}...")
+    sampled_folder = Path(sampled_folder or SAMPLED_FOLDER)
+    final_folder = Path(final_folder or FINAL_YOLO_FOLDER)
 
-    src = SAMPLED_FOLDER / split / f"{split}_ann.json"
-    dst = FINAL_YOLO_FOLDER / split / f"{split}_ann.json"
+    src = sampled_folder / split / f"{split}_ann.json"
+    dst = final_folder / split / f"{split}_ann.json"
 
     ensure_dir(dst.parent)
 
@@ -63,12 +65,15 @@ def copy_json(split):
         print(f"JSON not found: {src}")
 
 # STEP 1: COPY ONLY FILTERED IMAGES
-def copy_filtered_images(split):
+def copy_filtered_images(split, sampled_folder=None, original_split_folder=None, final_folder=None):
     print(f"\n Copying images for {split}...")
+    sampled_folder = Path(sampled_folder or SAMPLED_FOLDER)
+    original_split_folder = Path(original_split_folder or ORIGINAL_SPLIT_FOLDER)
+    final_folder = Path(final_folder or FINAL_YOLO_FOLDER)
 
-    json_path = SAMPLED_FOLDER / split / f"{split}_ann.json"
-    original_img_dir = ORIGINAL_SPLIT_FOLDER / split / "images"
-    target_dir = FINAL_YOLO_FOLDER / split / "images"
+    json_path = sampled_folder / split / f"{split}_ann.json"
+    original_img_dir = original_split_folder / split / "images"
+    target_dir = final_folder / split / "images"
 
     ensure_dir(target_dir)
 
@@ -93,12 +98,15 @@ def copy_filtered_images(split):
         print(f"Missing {len(missing)} images:", missing[:10])
 
 # STEP 2: COPY ONLY CORRESPONDING YOLO LABEL FILES
-def copy_filtered_labels(split):
+def copy_filtered_labels(split, sampled_folder=None, original_split_folder=None, final_folder=None):
     print(f"\n Copying labels for {split}...")
+    sampled_folder = Path(sampled_folder or SAMPLED_FOLDER)
+    original_split_folder = Path(original_split_folder or ORIGINAL_SPLIT_FOLDER)
+    final_folder = Path(final_folder or FINAL_YOLO_FOLDER)
 
-    json_path = SAMPLED_FOLDER / split / f"{split}_ann.json"
-    original_label_dir = ORIGINAL_SPLIT_FOLDER / split / "labels"
-    target_dir = FINAL_YOLO_FOLDER / split / "labels"
+    json_path = sampled_folder / split / f"{split}_ann.json"
+    original_label_dir = original_split_folder / split / "labels"
+    target_dir = final_folder / split / "labels"
 
     ensure_dir(target_dir)
 
@@ -247,6 +247,47 @@ def convert_video_list(base_dataset_folder, video_list, annotation_list, frames_
     with open(json_ann_file, 'w') as off:
         json.dump(data, off)
 
+
+# SPLIT PERSONALIZZATO
+TRAIN_IDS = [
+    "001-001", "001-002", "001-003", "001-004", "001-005", "001-006", "001-007", "001-008",
+    "002-001", "002-002", "002-003", "002-004", "002-005", "002-006", "002-007", "002-008",
+    "003-001", "003-002", "003-003", "003-004", "003-005", "003-006", "003-007", "003-008",
+    "004-001", "004-002", "004-003", "004-004", "004-005", "004-006", "004-007", "004-008"
+]
+VAL_IDS = [
+    "001-009", "001-011", "001-014", "002-009", "002-012", "002-014",
+    "003-009", "003-010", "003-012", "004-009", "004-011", "004-014"
+]
+TEST_IDS = [
+    "001-010", "001-012", "001-013", "001-015", "002-010", "002-011",
+    "002-013", "002-015", "003-011", "003-013", "003-014", "003-015",
+    "004-010", "004-012", "004-013", "004-015"
+]
+
+
+def get_base_id(name):
+    """ Extract the base video ID (e.g. "001-001") from a frames or annotations folder name """
+    return name.replace("_frames", "").replace("_annotations", "")
+
+
+def list_split_folders(base_dataset_folder, split_ids):
+    """
+    List the frames and annotations folders of the REAL-Colon dataset belonging to a split.
+
+    Args:
+        base_dataset_folder (str): Base folder for the REAL-Colon dataset in the original format.
+        split_ids (list of str): Base video IDs of the split (e.g. TRAIN_IDS).
+
+    Returns:
+        tuple: (video_list, annotation_list) sorted lists of folder names.
+    """
+    video_list = sorted([x for x in os.listdir(base_dataset_folder) if x.endswith("_frames")])
+    annotation_list = sorted([x for x in os.listdir(base_dataset_folder) if x.endswith("_annotations")])
+    return ([x for x in video_list if get_base_id(x) in split_ids],
+            [x for x in annotation_list if get_base_id(x) in split_ids])
+
+
 if __name__ == "__main__":
     # Parameters
     base_dataset_folder = "/path/to/REAL-colon" # Path to the folder of the original REAL-COLON dataset (update with proper value)
@@ -254,24 +295,6 @@ if __name__ == "__main__":
     num_positives_per_lesions = -1  # Number of frames with boxes for each polyp to be included in the output dataset
     negative_ratio = 1  # Ratio of images without boxes for each video to be included in the output dataset [0,1]
 
-    #SPLIT PERSONALIZZATO
-    train_ids = [
-        "001-001", "001-002", "001-003", "001-004", "001-005", "001-006", "001-007", "001-008",
-        "002-001", "002-002", "002-003", "002-004", "002-005", "002-006", "002-007", "002-008",
-        "003-001", "003-002", "003-003", "003-004", "003-005", "003-006", "003-007", "003-008",
-        "004-001", "004-002", "004-003", "004-004", "004-005", "004-006", "004-007", "004-008"
-    ]
-    val_ids = [
-        "001-009", "001-011", "001-014", "002-009", "002-012", "002-014",
-        "003-009", "003-010", "003-012", "004-009", "004-011", "004-014"
-    ]
-    test_ids = [
-        "001-010", "001-012", "001-013", "001-015", "002-010", "002-011",
-        "002-013", "002-015", "003-011", "003-013", "003-014", "003-015",
-        "004-010", "004-012", "004-013", "004-015"
-    ]
-
-
     # # Further filter to keep only studies that start with "001" if needed
     # video_list = [x for x in video_list if x.startswith("004")]
     # annotation_list = [x for x in annotation_list if x.startswith("004")]
@@ -300,22 +323,9 @@ if __name__ == "__main__":
     os.makedirs(txt_test_folder, exist_ok=False)
 
     # conversion
-    # Funzione per estrarre ID base tipo "001-001"
-    def get_base_id(name):
-        return name.replace("_frames","").replace("_annotations","")
-
-    # Filtra le cartelle frames e annotations in base agli ID
-    video_list = sorted([x for x in os.listdir(base_dataset_folder) if x.endswith("_frames")])
-    annotation_list = sorted([x for x in os.listdir(base_dataset_folder) if x.endswith("_annotations")])
-
-    video_list_train = [x for x in video_list if get_base_id(x) in train_ids]
-    annotation_list_train = [x for x in annotation_list if get_base_id(x) in train_ids]
-
-    video_list_validation = [x for x in video_list if get_base_id(x) in val_ids]
-    annotation_list_validation = [x for x in annotation_list if get_base_id(x) in val_ids]
-
-    video_list_test = [x for x in video_list if get_base_id(x) in test_ids]
-    annotation_list_test = [x for x in annotation_list if get_base_id(x) in test_ids]
+    video_list_train, annotation_list_train = list_split_folders(base_dataset_folder, TRAIN_IDS)
+    video_list_validation, annotation_list_validation = list_split_folders(base_dataset_folder, VAL_IDS)
+    video_list_test, annotation_list_test = list_split_folders(base_dataset_folder, TEST_IDS)
 
     print("Train videos:", video_list_train)
     print("Train annotations:", annotation_list_train)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Cached runner for the full REAL-Colon formatting pipeline.
+
+This script chains the steps that are otherwise run by hand:
+
+1. export_yolo_coco_format.py      -> split/<split>/             (convert_video_list)
+2. sampling.py                     -> dataset/<split>/<split>_ann.json
+                                      (filter_neg_frames / filter_frames_val)
+3. build_yolo_sampled_dataset.py   -> final_yolo/<split>/        (copy_filtered_images / labels)
+4. build_rtdetr_sampled_dataset.py -> RTDETR/<split>_ann.json    (fix_coco_ids)
+
+Every stage declares its inputs, parameters and outputs. The outputs are written
+once into the cache folder under a hash of the stage code, its parameters and its
+inputs, then materialized into the working folder as hard links. When a stage hash
+is already in the cache the stage is skipped, so only the stages whose inputs or
+parameters changed are recomputed.
+
+Inputs produced by an earlier stage are identified by that stage hash. External
+inputs are hashed by content for files, and by relative name, size and
+modification time for folders (the original dataset has millions of frames).
+Materialized files are hard links to the cache: do not edit them in place.
+
+Usage:
+    python pipeline.py --base-dataset-folder /path/to/REAL-colon --work-dir /path/to/your/dir
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from export_yolo_coco_format import convert_video_list, list_split_folders, TRAIN_IDS, VAL_IDS, TEST_IDS
+from sampling import load_coco, save_coco, filter_neg_frames, filter_frames_val, summarize_split, \
+    NEG_PER_VIDEO_TRAIN, NEG_PER_VIDEO_VAL, POS_PER_VIDEO_VAL, RANDOM_SEED
+from build_yolo_sampled_dataset import copy_json, copy_filtered_images, copy_filtered_labels
+from build_rtdetr_sampled_dataset import fix_coco_ids
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name (str): Unique stage name, also used as cache sub-folder.
+        fn (callable): Function called as fn(**params, **inputs, **outputs).
+        inputs (dict): Keyword -> path read by the stage.
+        params (dict): Keyword -> JSON-serializable parameter.
+        outputs (dict): Keyword -> path (file or folder) written by the stage.
+        deps (list): Functions wrapped by fn; the source of their modules is part of the cache key.
+    """
+
+    def __init__(self, name, fn, inputs=None, params=None, outputs=None, deps=None):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps or [])
+        self.inputs = {k: Path(v) for k, v in (inputs or {}).items()}
+        self.params = params or {}
+        self.outputs = {k: Path(v) for k, v in (outputs or {}).items()}
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the SHA-256 of a file content."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def hash_path(path):
+    """Hash an external input: file content, or (name, size, mtime) of every entry of a folder."""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Stage input not found: {path}")
+    if path.is_file():
+        return hash_file(path)
+
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fname in sorted(files):
+            full = os.path.join(root, fname)
+            st = os.stat(full)
+            h.update(f"{os.path.relpath(full, path)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def hash_module(name):
+    """Return the SHA-256 of the whole source of a module (its helpers and constants included)."""
+    return hashlib.sha256(inspect.getsource(sys.modules[name]).encode()).hexdigest()
+
+
+def code_hash(stage):
+    """Hash the stage function and the modules of the functions it wraps."""
+    h = hashlib.sha256(inspect.getsource(stage.fn).encode())
+    for name in sorted({dep.__module__ for dep in stage.deps}):
+        h.update(f"{name}:{hash_module(name)}\n".encode())
+    return h.hexdigest()
+
+
+def stage_key(stage, produced):
+    """
+    Compute the cache key of a stage from its code, parameters and inputs.
+
+    The code is the stage function and the full source of the modules of its deps, so editing
+    e.g. sampling.py invalidates the sampling stages.
+
+    Args:
+        stage (Stage): Stage to hash.
+        produced (dict): Output path -> key of the stage that produced it.
+    """
+    inputs = {}
+    for k, path in sorted(stage.inputs.items()):
+        for out, key in produced.items():
+            if path == out or out in path.parents:
+                inputs[k] = f"{key}:{path.relative_to(out)}"
+                break
+        else:
+            inputs[k] = hash_path(path)
+
+    desc = {
+        "stage": stage.name,
+        "code": code_hash(stage),
+        "params": stage.params,
+        "inputs": inputs,
+        "outputs": sorted(stage.outputs),
+    }
+    return hashlib.sha256(json.dumps(desc, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def bytes_written(path):
+    """Total size of the files under path (symbolic links are not followed)."""
+    path = Path(path)
+    if not path.exists():
+        return 0
+    if not path.is_dir():
+        return path.lstat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for fname in files:
+            total += os.lstat(os.path.join(root, fname)).st_size
+    return total
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def materialize(src, dst):
+    """Replace dst with hard links to the cached src (file or folder)."""
+    dst = Path(dst)
+    if dst.is_dir() and not dst.is_symlink():
+        shutil.rmtree(dst)
+    elif dst.exists() or dst.is_symlink():
+        dst.unlink()
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if src.is_dir():
+        shutil.copytree(src, dst, symlinks=True, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(src, dst)
+
+
+def run_stage(stage, cache_dir, produced, force=False):
+    """
+    Run a single stage, or restore it from the cache.
+
+    Returns:
+        dict: stage report with keys 'stage', 'key', 'status', 'time' and 'bytes'.
+    """
+    tic = time.time()
+    key = stage_key(stage, produced)
+    entry = Path(cache_dir) / stage.name / key
+
+    if entry.exists() and not force:
+        status, written = "cached", 0
+    else:
+        staging = entry.with_name(key + ".tmp")
+        if staging.exists():
+            shutil.rmtree(staging)
+        if entry.exists():
+            shutil.rmtree(entry)
+        outputs = {}
+        for k, path in stage.outputs.items():
+            (staging / k).mkdir(parents=True)
+            outputs[k] = staging / k / path.name
+        stage.fn(**stage.params, **{k: str(v) for k, v in stage.inputs.items()},
+                 **{k: str(v) for k, v in outputs.items()})
+        written = bytes_written(staging)
+        os.replace(staging, entry)
+        status = "run"
+
+    for k, path in stage.outputs.items():
+        materialize(entry / k / path.name, path)
+        produced[path] = key
+
+    return {"stage": stage.name, "key": key, "status": status, "time": time.time() - tic, "bytes": written}
+
+
+def run_pipeline(stages, cache_dir, force=False):
+    """Run the stages in order, skipping the ones whose cache key is unchanged, and print a report."""
+    produced = {}
+    report = []
+    for stage in stages:
+        print(f"\n=== {stage.name} ===")
+        report.append(run_stage(stage, cache_dir, produced, force=force))
+        print(f"[{stage.name}] {report[-1]['status']} ({report[-1]['key']})")
+
+    print(f"\n{'Stage':<16}{'Status':>8}{'Time [s]':>12}{'Written [MB]':>15}")
+    for r in report:
+        print(f"{r['stage']:<16}{r['status']:>8}{r['time']:>12.2f}{r['bytes'] / 1e6:>15.1f}")
+    return report
+
+
+# Stage functions: thin wrappers over the existing scripts that read/write the declared paths
+def export_split(base_dataset_folder, video_ids, negative_ratio, num_positives_per_lesions, split_folder):
+    """export_yolo_coco_format.py for one split: images/, labels/ and <split>_ann.json in split_folder."""
+    split = Path(split_folder).name
+    video_list, annotation_list = list_split_folders(base_dataset_folder, video_ids)
+    os.makedirs(os.path.join(split_folder, "labels"), exist_ok=True)
+    convert_video_list(base_dataset_folder, video_list, annotation_list,
+                       os.path.join(split_folder, "images"), os.path.join(split_folder, "labels"),
+                       os.path.join(split_folder, f"{split}_ann.json"), negative_ratio=negative_ratio,
+                       num_positives_per_lesions=num_positives_per_lesions)
+
+
+def sample_split(ann_json, mode, neg_per_video, pos_per_video, seed, sampled_json):
+    """sampling.py for one split: mode is 'train', 'val' or 'full' (left unchanged)."""
+    data = load_coco(ann_json)
+    if mode == "train":
+        data = filter_neg_frames(data, neg_per_video=neg_per_video, seed=seed)
+    elif mode == "val":
+        data = filter_frames_val(data, neg_per_video=neg_per_video, pos_per_video=pos_per_video, seed=seed)
+    summarize_split(f"{mode} (sampled)", data)
+    save_coco(data, sampled_json)
+
+
+def build_yolo_split(sampled_json, split_folder, final_split_folder):
+    """build_yolo_sampled_dataset.py for one split."""
+    split = Path(final_split_folder).name
+    sampled_folder = Path(sampled_json).parent.parent
+    original_split_folder = Path(split_folder).parent
+    final_folder = Path(final_split_folder).parent
+    copy_json(split, sampled_folder, final_folder)
+    copy_filtered_images(split, sampled_folder, original_split_folder, final_folder)
+    copy_filtered_labels(split, sampled_folder, original_split_folder, final_folder)
+
+
+def build_rtdetr_split(sampled_json, rtdetr_json):
+    """build_rtdetr_sampled_dataset.py for one split."""
+    fix_coco_ids(sampled_json, rtdetr_json)
+
+
+def build_stages(base_dataset_folder, work_dir, negative_ratio=1, num_positives_per_lesions=-1):
+    """Declare the stages of the full pipeline."""
+    work_dir = Path(work_dir)
+    split_ids = {"train": TRAIN_IDS, "val": VAL_IDS, "test": TEST_IDS}
+    sampling = {"train": ("train", NEG_PER_VIDEO_TRAIN, None),
+                "val": ("val", NEG_PER_VIDEO_VAL, POS_PER_VIDEO_VAL),
+                "test": ("full", None, None)}
+
+    stages = []
+    for split in ["train", "val", "test"]:
+        split_folder = work_dir / "split" / split
+        sampled_json = work_dir / "dataset" / split / f"{split}_ann.json"
+        stages.append(Stage(f"export_{split}", export_split,
+                            inputs={"base_dataset_folder": base_dataset_folder},
+                            params={"video_ids": split_ids[split], "negative_ratio": negative_ratio,
+                                    "num_positives_per_lesions": num_positives_per_lesions},
+                            outputs={"split_folder": split_folder},
+                            deps=[convert_video_list, list_split_folders]))
+        mode, neg_per_video, pos_per_video = sampling[split]
+        stages.append(Stage(f"sample_{split}", sample_split,
+                            inputs={"ann_json": split_folder / f"{split}_ann.json"},
+                            params={"mode": mode, "neg_per_video": neg_per_video,
+                                    "pos_per_video": pos_per_video, "seed": RANDOM_SEED},
+                            outputs={"sampled_json": sampled_json},
+                            deps=[load_coco, filter_neg_frames, filter_frames_val, save_coco]))
+        if split != "test":
+            stages.append(Stage(f"yolo_{split}", build_yolo_split,
+                                inputs={"sampled_json": sampled_json, "split_folder": split_folder},
+                                outputs={"final_split_folder": work_dir / "final_yolo" / split},
+                                deps=[copy_json, copy_filtered_images, copy_filtered_labels]))
+        stages.append(Stage(f"rtdetr_{split}", build_rtdetr_split,
+                            inputs={"sampled_json": sampled_json},
+                            outputs={"rtdetr_json": work_dir / "RTDETR" / f"{split}_ann.json"},
+                            deps=[fix_coco_ids]))
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-dataset-folder", type=str, required=True, help="Original REAL-Colon dataset folder")
+    parser.add_argument("--work-dir", type=str, required=True, help="Output folder (split/, dataset/, final_yolo/, RTDETR/)")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Stage cache folder (default: <work-dir>/.cache)")
+    parser.add_argument("--negative-ratio", type=float, default=1, help="Ratio of negative frames kept by the export")
+    parser.add_argument("--num-positives-per-lesions", type=int, default=-1, help="Positive frames per lesion (-1 = all)")
+    parser.add_argument("--force", action="store_true", help="Recompute every stage ignoring the cache")
+    args = parser.parse_args()
+
+    cache_dir = Path(args.cache_dir) if args.cache_dir else Path(args.work_dir) / ".cache"
+    stages = build_stages(Path(args.base_dataset_folder).resolve(), Path(args.work_dir).resolve(),
+                          negative_ratio=args.negative_ratio,
+                          num_positives_per_lesions=args.num_positives_per_lesions)
+    run_pipeline(stages, cache_dir, force=args.force)
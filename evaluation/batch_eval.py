@@ -0,0 +1,188 @@
+"""
+COCO evaluation of many prediction files against the same ground truth.
+
+Scoring every model / epoch with its own COCOeval loads, indexes and prepares the
+same test annotations each time. Here the ground truth is loaded once and its
+prepared index (COCOeval.prepareGts) is built once in the main process; the
+prediction files are then evaluated in worker processes forked from it, which
+share the ground truth and its index without copying or pickling them. Each
+worker only loads its predictions (as a PredictionStore) and returns the
+summarize() metrics.
+
+Prediction files are given on the command line, or as a text file with one
+"<name> <predictions.json>" pair per line (--list). The comparison table is
+printed and written to a CSV file.
+
+Usage:
+    python batch_eval.py --gt <coco_gt.json> --pred yolov7.json rtdetr.json [--workers 4] [--output results.csv]
+    python batch_eval.py --gt <coco_gt.json> --list runs.txt --workers 4 --iou-thr 0.2
+"""
+
+import argparse
+import copy
+import csv
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+from pycocotools.coco import COCO
+
+from bootstrap import DET_STATS
+from cocoeval import COCOeval
+from prediction_store import PredictionStore
+
+# (cocoGt, prepared COCOeval) inherited by the forked workers
+_shared = None
+
+
+def prepare_gt(gt_path, iou_type="bbox", iou_thrs=None):
+    """
+    Load the ground truth and prepare its index once.
+
+    Args:
+        gt_path (str): COCO GT json file.
+        iou_type (str): 'bbox' or 'segm'.
+        iou_thrs (np.ndarray): IoU thresholds (default: COCO 0.5:0.95).
+
+    Returns:
+        COCOeval: template evaluation (no detections) with params and gtIndex set.
+    """
+    coco_gt = COCO(gt_path)
+    template = COCOeval(coco_gt, None, iou_type)
+    if iou_thrs is not None:
+        template.params.iouThrs = np.asarray(iou_thrs, dtype=float)
+    template._checkParams()
+    template.prepareGts()
+    return template
+
+
+def evaluate_predictions(template, pred_path, save_eval=None):
+    """
+    Evaluate one prediction file reusing the prepared ground truth of template.
+
+    Returns:
+        np.ndarray: COCOeval.stats (-1 for a prediction file without detections).
+    """
+    coco_gt = template.cocoGt
+    E = COCOeval(coco_gt, None, template.params.iouType)
+    E.params = copy.deepcopy(template.params)
+    E.gtIndex = template.gtIndex
+    with open(pred_path, "r") as f:
+        preds = json.load(f)
+    if len(preds) == 0:
+        print(f"No detections in {pred_path}")
+        return -np.ones(len(DET_STATS))
+    if E.params.iouType == "segm":
+        # PredictionStore only holds boxes: masks go through the COCO results loader
+        E.cocoDt = coco_gt.loadRes(preds)
+    else:
+        # detections as arrays, indexed by the image codes of the prepared gt
+        E.cocoDt = PredictionStore.from_results(preds, template.gtIndex["imgIndex"])
+    E.evaluate()
+    E.accumulate()
+    E.summarize()
+    if save_eval:
+        E.saveEval(save_eval)
+    return E.stats
+
+
+def _init_worker(template):
+    global _shared
+    _shared = template
+
+
+def _evaluate_worker(job):
+    name, pred_path, save_eval = job
+    tic = time.time()
+    stats = evaluate_predictions(_shared, pred_path, save_eval)
+    return name, stats, time.time() - tic
+
+
+def batch_evaluate(template, runs, workers=1, save_dir=None):
+    """
+    Evaluate several prediction files against the prepared ground truth.
+
+    Args:
+        template (COCOeval): Result of prepare_gt.
+        runs (list): (name, predictions.json) pairs.
+        workers (int): Number of worker processes (forked, sharing the gt index).
+        save_dir (str): If set, also save every evaluation as <save_dir>/<name>.npz (COCOeval.saveEval).
+
+    Returns:
+        list of dict: one row per run with the summarize() metrics and the evaluation time.
+    """
+    jobs = [(name, path, os.path.join(save_dir, f"{name}.npz") if save_dir else None) for name, path in runs]
+    if workers > 1 and len(jobs) > 1:
+        ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else None)
+        with ctx.Pool(min(workers, len(jobs)), initializer=_init_worker, initargs=(template,)) as pool:
+            results = pool.map(_evaluate_worker, jobs, chunksize=1)
+    else:
+        _init_worker(template)
+        results = [_evaluate_worker(job) for job in jobs]
+
+    rows = []
+    for name, stats, seconds in results:
+        row = {"run": name}
+        row.update({s[0]: float(v) for s, v in zip(DET_STATS, stats)})
+        row["time [s]"] = round(seconds, 2)
+        rows.append(row)
+    return rows
+
+
+def read_runs(pred_paths=None, list_path=None):
+    """(name, path) pairs from the --pred files (named after the file) and / or a --list file."""
+    runs = [(os.path.splitext(os.path.basename(p))[0], p) for p in pred_paths or []]
+    if list_path:
+        with open(list_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    name, path = line.split(maxsplit=1)
+                    runs.append((name, path))
+    names = [name for name, _ in runs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicated run names: {names}")
+    return runs
+
+
+def print_table(rows, path=None):
+    """Print the comparison table and optionally write it to a CSV file."""
+    header = list(rows[0])
+    width = max(12, max(len(r["run"]) for r in rows) + 2)
+    print("\n" + f"{'run':<{width}}" + "".join(f"{h:>9}" for h in header[1:]))
+    for r in rows:
+        print(f"{r['run']:<{width}}" + "".join(f"{r[h]:>9.3f}" for h in header[1:]))
+    if path:
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=header)
+            writer.writeheader()
+            writer.writerows(rows)
+        print("Saved:", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gt", type=str, required=True, help="COCO GT json file")
+    parser.add_argument("--pred", type=str, nargs="*", help="Predictions json files (COCO detection format)")
+    parser.add_argument("--list", type=str, help="Text file with one '<name> <predictions.json>' per line")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--iou-type", type=str, default="bbox", choices=["bbox", "segm"])
+    parser.add_argument("--iou-thr", type=float, nargs="*", help="IoU thresholds (default: COCO 0.5:0.95)")
+    parser.add_argument("--output", type=str, help="CSV file for the comparison table")
+    parser.add_argument("--save-eval-dir", type=str, help="Also save each evaluation as <dir>/<name>.npz")
+    args = parser.parse_args()
+
+    runs = read_runs(args.pred, args.list)
+    if not runs:
+        parser.error("no prediction file given (--pred or --list)")
+    if args.save_eval_dir:
+        os.makedirs(args.save_eval_dir, exist_ok=True)
+
+    tic = time.time()
+    template = prepare_gt(args.gt, args.iou_type, args.iou_thr)
+    print(f"Ground truth prepared once ({time.time() - tic:.1f}s)")
+    rows = batch_evaluate(template, runs, workers=args.workers, save_dir=args.save_eval_dir)
+    print_table(rows, args.output)
+    print(f"{len(runs)} prediction files evaluated in {time.time() - tic:.1f}s")
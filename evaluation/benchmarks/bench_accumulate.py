@@ -0,0 +1,160 @@
+"""
+Benchmark of COCOeval.accumulate on a synthetic million-detection input.
+
+accumulate() takes the precision envelope and the precision / score at every
+recall threshold with array operations (cocoeval.precisionAtRecall, all the IoU
+thresholds at once). This script times it against the original COCO API code,
+which loops over the IoU thresholds, takes the envelope with a backwards Python
+loop and fills the recall thresholds one by one (loopPrecisionAtRecall below),
+and checks that precision, recall and scores are identical.
+
+The input is generated from a fixed seed: frames of 1240x1080 with 0 to 3 polyp
+boxes (about 30% positive frames, some crowd boxes) and --dets-per-frame
+detections per frame, part of them jittered copies of the gt boxes.
+
+Usage (from the evaluation folder):
+    python benchmarks/bench_accumulate.py [--n-dets 1000000] [--dets-per-frame 50] [--repeat 3] [--seed 0]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from pycocotools.coco import COCO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cocoeval  # noqa: E402
+from cocoeval import COCOeval  # noqa: E402
+from id_index import IdIndex  # noqa: E402
+from prediction_store import PredictionStore  # noqa: E402
+
+
+def loopPrecisionAtRecall(tps, fps, npig, dtScores, recThrs):
+    '''
+    Original COCO API computation of cocoeval.precisionAtRecall: one IoU threshold
+    at a time, backwards loop for the precision envelope and per recall threshold fill
+    '''
+    T, R = len(tps), len(recThrs)
+    precision, scores, recall = np.zeros((T, R)), np.zeros((T, R)), np.zeros(T)
+    tp_sum = np.cumsum(tps, axis=1).astype(dtype=float)
+    fp_sum = np.cumsum(fps, axis=1).astype(dtype=float)
+    for t, (tp, fp) in enumerate(zip(tp_sum, fp_sum)):
+        nd = len(tp)
+        rc = tp / npig
+        pr = tp / (fp + tp + np.spacing(1))
+        q = np.zeros((R,))
+        ss = np.zeros((R,))
+        recall[t] = rc[-1] if nd else 0
+
+        pr = pr.tolist()
+        q = q.tolist()
+        for i in range(nd - 1, 0, -1):
+            if pr[i] > pr[i - 1]:
+                pr[i - 1] = pr[i]
+
+        inds = np.searchsorted(rc, recThrs, side='left')
+        try:
+            for ri, pi in enumerate(inds):
+                q[ri] = pr[pi]
+                ss[ri] = dtScores[pi]
+        except IndexError:
+            pass
+        precision[t] = np.array(q)
+        scores[t] = ss
+    return precision, scores, recall
+
+
+def make_dataset(n_dets, dets_per_frame=50, seed=0):
+    """
+    Synthetic REAL-Colon like ground truth and detections.
+
+    Returns:
+        (COCO, PredictionStore): ground truth and n_dets detections.
+    """
+    rng = np.random.default_rng(seed)
+    n_frames = max(1, n_dets // dets_per_frame)
+    img_ids = [f"{1 + v % 4:03d}-{1 + v:03d}_{f}" for v in range(20) for f in range(-(-n_frames // 20))][:n_frames]
+
+    # gt boxes: 0 to 3 per frame, 30% positive frames
+    n_gt = np.where(rng.random(n_frames) < 0.3, rng.integers(1, 4, n_frames), 0)
+    gt_frame = np.repeat(np.arange(n_frames), n_gt)
+    wh = rng.uniform(20, 400, (len(gt_frame), 2)).round()
+    xy = rng.uniform(0, [800, 600], (len(gt_frame), 2)).round()
+    crowd = rng.random(len(gt_frame)) < 0.02
+    images = [{"id": i, "width": 1240, "height": 1080} for i in img_ids]
+    anns = [{"id": n + 1, "image_id": img_ids[f], "category_id": 0, "bbox": [*map(float, b)],
+             "area": float(b[2] * b[3]), "iscrowd": int(c)}
+            for n, (f, b, c) in enumerate(zip(gt_frame, np.hstack([xy, wh]), crowd))]
+    coco_gt = COCO()
+    coco_gt.dataset = {"images": images, "annotations": anns, "categories": [{"id": 0, "name": "polyp"}]}
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_gt.createIndex()
+
+    # detections: jittered gt boxes on positive frames (60%), random boxes otherwise
+    dt_frame = rng.integers(0, n_frames, n_dets)
+    gt_start = np.r_[0, np.cumsum(n_gt)]
+    has_gt = n_gt[dt_frame] > 0
+    near = has_gt & (rng.random(n_dets) < 0.6)
+    pick = gt_start[dt_frame] + (rng.random(n_dets) * np.maximum(n_gt[dt_frame], 1)).astype(np.int64)
+    pick = np.minimum(pick, max(len(gt_frame) - 1, 0))
+    xywh = np.hstack([rng.uniform(0, [800, 600], (n_dets, 2)), rng.uniform(10, 400, (n_dets, 2))])
+    if len(gt_frame):
+        jitter = np.hstack([rng.uniform(-12, 12, (n_dets, 2)), rng.uniform(0.85, 1.15, (n_dets, 2))])
+        gt_box = np.hstack([xy, wh])[pick]
+        xywh[near] = np.hstack([gt_box[:, :2] + jitter[:, :2], gt_box[:, 2:] * jitter[:, 2:]])[near]
+    score = rng.random(n_dets).round(3)  # 3 decimals: many tied scores
+    index = IdIndex(coco_gt.getImgIds())
+    store = PredictionStore(index, index.encode([img_ids[f] for f in range(n_frames)])[dt_frame],
+                            score, xywh, np.zeros(n_dets, dtype=np.int64))
+    return coco_gt, store
+
+
+def time_accumulate(E, repeat):
+    """Best wall time of repeat accumulate() calls, and the resulting eval dict."""
+    best = np.inf
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tic = time.perf_counter()
+            E.accumulate()
+            best = min(best, time.perf_counter() - tic)
+    return best, E.eval
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-dets", type=int, default=1000000, help="Number of detections")
+    parser.add_argument("--dets-per-frame", type=int, default=50, help="Mean detections per frame")
+    parser.add_argument("--repeat", type=int, default=3, help="accumulate() runs per implementation (best time)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic input")
+    args = parser.parse_args()
+
+    tic = time.perf_counter()
+    coco_gt, store = make_dataset(args.n_dets, args.dets_per_frame, args.seed)
+    print(f"Input: {len(store)} detections, {store.n_images} frames, {len(coco_gt.anns)} gt boxes "
+          f"({time.perf_counter() - tic:.1f}s)")
+
+    E = COCOeval(coco_gt, store, "bbox")
+    tic = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        E.evaluate()
+    print(f"evaluate(): {time.perf_counter() - tic:.2f}s")
+
+    t_vec, ev_vec = time_accumulate(E, args.repeat)
+    vectorized = cocoeval.precisionAtRecall
+    cocoeval.precisionAtRecall = loopPrecisionAtRecall
+    try:
+        t_loop, ev_loop = time_accumulate(E, args.repeat)
+    finally:
+        cocoeval.precisionAtRecall = vectorized
+
+    same = all(np.array_equal(ev_vec[k], ev_loop[k]) for k in ("precision", "recall", "scores"))
+    print(f"accumulate() loop envelope: {t_loop:.2f}s")
+    print(f"accumulate() vectorized:    {t_vec:.2f}s ({t_loop / t_vec:.1f}x faster)")
+    print(f"precision / recall / scores identical: {same}")
+    if not same:
+        sys.exit(1)
@@ -0,0 +1,228 @@
+"""
+Bootstrap confidence intervals of the COCO AP / AR metrics by resampling test videos.
+
+Frames of a video are strongly correlated, so the resampling unit is the video
+(the part of the image id before "_"). Each replicate draws the test videos with
+replacement, which amounts to giving every video an integer weight. The per-image
+matches computed once by COCOeval.evaluate (evalDets / evalGts) do not depend on
+the weights, so every replicate is recomputed from them with weighted cumulative
+sums instead of a new evaluation:
+
+- the precision envelope and the recall lookup only need the last row of each
+  run of consecutive true positives, so only those rows are kept;
+- the per video TP / FP counts between kept rows form small [V x rows] matrices,
+  and the weighted counts of all the replicates are one matrix product with the
+  [B x V] weights followed by a cumulative sum.
+
+With all the weights equal to 1 this gives exactly COCOeval.stats. In a replicate,
+detections of a duplicated video keep their position in the score order (ties
+between copies are not re-broken as a concatenated evaluation would do).
+
+Usage:
+    python bootstrap.py --gt <coco_gt.json> --pred <predictions.json> [--n-boot 1000]
+    python bootstrap.py --eval <results.npz>   # file written by COCOeval.saveEval
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from cocoeval import COCOeval, recallCounts
+from id_index import IdIndex
+
+# (name, ap, iouThr, areaRng, maxDets) of COCOeval.summarize for bbox / segm, in order
+DET_STATS = [
+    ("AP", 1, None, "all", 100),
+    ("AP50", 1, .5, "all", 100),
+    ("AP75", 1, .75, "all", 100),
+    ("APs", 1, None, "small", 100),
+    ("APm", 1, None, "medium", 100),
+    ("APl", 1, None, "large", 100),
+    ("AR1", 0, None, "all", 1),
+    ("AR10", 0, None, "all", 10),
+    ("AR100", 0, None, "all", 100),
+    ("ARs", 0, None, "small", 100),
+    ("ARm", 0, None, "medium", 100),
+    ("ARl", 0, None, "large", 100),
+]
+
+
+def video_weights(n_videos, n_boot, seed=0):
+    """[n_boot x n_videos] number of times each video is drawn in each replicate."""
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(n_videos, np.full(n_videos, 1.0 / n_videos), size=n_boot).astype(np.float64)
+
+
+def image_videos(coco_eval):
+    """Video code of every image of the evaluation, and the number of videos."""
+    index = IdIndex(coco_eval._paramsEval.imgIds)
+    videos, names = index.videos()
+    return videos, len(names)
+
+
+def weighted_curves(tp, fp, video, npig, weights, rec_thrs):
+    """
+    Precision at the recall thresholds and max recall of every replicate, for one IoU threshold.
+
+    Args:
+        tp (np.ndarray): [D] true positive flags of the detections sorted by score.
+        fp (np.ndarray): [D] false positive flags of the same detections.
+        video (np.ndarray): [D] video code of each detection.
+        npig (np.ndarray): [B] weighted number of non ignored gts of each replicate (> 0).
+        weights (np.ndarray): [B x V] video weights.
+        rec_thrs (np.ndarray): [R] recall thresholds.
+
+    Returns:
+        (np.ndarray, np.ndarray): precision [B x R] and recall [B].
+    """
+    B, V = weights.shape
+    R = len(rec_thrs)
+    # Rows are cut after every run of consecutive TPs: inside a run the precision only
+    # grows (in every replicate), so the envelope and the recall lookup only need the
+    # last row of each run. Segment j holds the FPs before run j and the TPs of run j.
+    tp_pos = np.flatnonzero(tp)
+    if len(tp_pos) == 0:
+        return np.zeros((B, R)), np.zeros(B)
+    run_end = tp_pos[np.r_[np.diff(tp_pos) > 1, True]]
+    n = len(run_end)
+    fp_pos = np.flatnonzero(fp)
+    fp_pos = fp_pos[fp_pos < run_end[-1]]
+    counts = []
+    for pos in (tp_pos, fp_pos):
+        seg = np.searchsorted(run_end, pos)
+        counts.append(np.bincount(seg * V + video[pos], minlength=n * V).reshape(n, V).T)
+
+    # weighted TP / FP counts at the end of each run
+    tps = np.cumsum(weights @ counts[0], axis=1)
+    fps = np.cumsum(weights @ counts[1], axis=1)
+    pr = tps / (fps + tps + np.spacing(1))
+    pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+
+    # first run end with tp >= c (integer counts, see cocoeval.precisionAtRecall; the
+    # weighted counts are integers stored exactly in float64), all the replicates at once
+    c = recallCounts(npig[:, None], rec_thrs)
+    stride = max(tps[:, -1].max(), c.max()) + 1
+    offset = np.arange(B)[:, None] * float(stride)
+    tps += offset
+    inds = np.searchsorted(tps.ravel(), (c + offset).ravel()).reshape(B, R)
+    inds -= np.arange(B)[:, None] * n
+    reached = inds < n
+    q = np.where(reached, np.take_along_axis(pr, np.minimum(inds, n - 1), axis=1), 0)
+    return q, (tps[:, -1] - offset[:, 0]) / npig
+
+
+def bootstrap_eval(coco_eval, weights, videos, settings=None):
+    """
+    Precision and recall arrays of every replicate, as COCOeval.accumulate computes them.
+
+    Args:
+        coco_eval (COCOeval): Evaluated object (evaluate() or loadEval()).
+        weights (np.ndarray): [B x V] video weights.
+        videos (np.ndarray): [I] video code of every image of the evaluation.
+        settings (set): (area range index, maxDets index) pairs to compute (default: all).
+
+    Returns:
+        dict: 'precision' [B x T x R x K x A x M] and 'recall' [B x T x K x A x M], -1 where
+        there is no gt or the setting was not computed.
+    """
+    p = coco_eval._paramsEval
+    dets, gts = coco_eval.evalDets, coco_eval.evalGts
+    B = len(weights)
+    T, R = len(p.iouThrs), len(p.recThrs)
+    K, A, M = len(p.catIds) if p.useCats else 1, len(p.areaRng), len(p.maxDets)
+    precision = -np.ones((B, T, R, K, A, M))
+    recall = -np.ones((B, T, K, A, M))
+
+    dt_group = dets["catIdx"].astype(np.int64) * A + dets["areaIdx"]
+    gt_group = gts["catIdx"].astype(np.int64) * A + gts["areaIdx"]
+    for k in range(K):
+        for a in range(A):
+            ms = [m for m in range(M) if settings is None or (a, m) in settings]
+            if not ms:
+                continue
+            g0 = k * A + a
+            gt = gts[np.searchsorted(gt_group, g0, "left"):np.searchsorted(gt_group, g0, "right")]
+            gt = gt[~gt["ignore"]]
+            npig = weights @ np.bincount(videos[gt["imgIdx"]], minlength=weights.shape[1])
+            has_gt = npig > 0
+            if not has_gt.any():
+                continue
+            dt = dets[np.searchsorted(dt_group, g0, "left"):np.searchsorted(dt_group, g0, "right")]
+            for m in ms:
+                E = dt[dt["rank"] < p.maxDets[m]]
+                E = E[np.argsort(-E["score"], kind="mergesort")]
+                matched = E["matches"] != 0
+                video = videos[E["imgIdx"]]
+                for t in range(T):
+                    q, rc = weighted_curves(matched[:, t] & ~E["ignore"][:, t], ~matched[:, t] & ~E["ignore"][:, t],
+                                            video, np.where(has_gt, npig, 1), weights, p.recThrs)
+                    precision[has_gt, t, :, k, a, m] = q[has_gt]
+                    recall[has_gt, t, k, a, m] = rc[has_gt]
+    return {"precision": precision, "recall": recall}
+
+
+def summary_stats(boot, params, stats=DET_STATS):
+    """
+    COCOeval.summarize metrics of every replicate.
+
+    Returns:
+        np.ndarray: [B x len(stats)], -1 where a metric is undefined (as summarize).
+    """
+    out = []
+    for _, ap, iou_thr, area_rng, max_dets in stats:
+        s = boot["precision"] if ap == 1 else boot["recall"]
+        if iou_thr is not None:
+            s = s[:, np.where(iou_thr == params.iouThrs)[0]]
+        aind = [i for i, lbl in enumerate(params.areaRngLbl) if lbl == area_rng]
+        mind = [i for i, m in enumerate(params.maxDets) if m == max_dets]
+        s = s[..., aind, :][..., mind]
+        s = s.reshape(len(s), -1)
+        out.append([np.mean(r[r > -1]) if (r > -1).any() else -1 for r in s])
+    return np.array(out).T
+
+
+def bootstrap_ci(coco_eval, n_boot=1000, alpha=0.05, seed=0, stats=DET_STATS):
+    """
+    Percentile bootstrap confidence intervals of the summary metrics, resampling videos.
+
+    Returns:
+        dict: name -> (estimate on the test set, lower bound, upper bound).
+    """
+    p = coco_eval._paramsEval
+    videos, n_videos = image_videos(coco_eval)
+    settings = {(a, m) for _, _, _, area_rng, max_dets in stats
+                for a, lbl in enumerate(p.areaRngLbl) if lbl == area_rng
+                for m, md in enumerate(p.maxDets) if md == max_dets}
+    # the first row (all the videos once) is the estimate on the test set itself
+    weights = np.vstack([np.ones(n_videos), video_weights(n_videos, n_boot, seed)])
+    reps = summary_stats(bootstrap_eval(coco_eval, weights, videos, settings), p, stats)
+    point, reps = reps[0], np.where(reps[1:] > -1, reps[1:], np.nan)
+    low, high = np.nanpercentile(reps, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return {name: (point[i], low[i], high[i]) for i, (name, *_) in enumerate(stats)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gt", type=str, help="COCO GT json file")
+    parser.add_argument("--pred", type=str, help="Predictions json (COCO detection format)")
+    parser.add_argument("--eval", type=str, help="Evaluation results saved by COCOeval.saveEval (instead of --gt/--pred)")
+    parser.add_argument("--n-boot", type=int, default=1000, help="Number of bootstrap replicates")
+    parser.add_argument("--alpha", type=float, default=0.05, help="1 - confidence level")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    if args.eval:
+        E = COCOeval.loadEval(args.eval)
+    else:
+        from pycocotools.coco import COCO
+        cocoGt = COCO(args.gt)
+        E = COCOeval(cocoGt, cocoGt.loadRes(args.pred), "bbox")
+        E.evaluate()
+
+    tic = time.time()
+    ci = bootstrap_ci(E, n_boot=args.n_boot, alpha=args.alpha, seed=args.seed)
+    print(f"\n{args.n_boot} video bootstrap replicates ({time.time() - tic:.1f}s), "
+          f"{100 * (1 - args.alpha):.0f}% confidence intervals:")
+    for name, (est, low, high) in ci.items():
+        print(f"{name:<8}{est:>8.3f}  [{low:.3f}, {high:.3f}]")
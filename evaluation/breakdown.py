@@ -0,0 +1,194 @@
+"""
+Per-video and per-lesion breakdown of a single COCO evaluation.
+
+The per-image matches of one COCOeval run (evalDets / evalGts) are grouped
+instead of evaluating every subset again:
+
+- per video: AP / AR as COCOeval.summarize would report them on the frames of
+  that video alone (the weighted accumulate of bootstrap.py with one weight
+  vector per video), plus the recall at a fixed IoU threshold (fraction of the
+  annotated boxes matched by a detection);
+- per lesion (the `unique_id` of the exported annotations): number of annotated
+  frames, frames where the lesion box is detected at the IoU threshold, recall,
+  and the recall averaged over the COCO IoU thresholds.
+
+The fixed IoU threshold (0.2 for the clinical metrics) is added to the COCO
+thresholds of the same evaluation; matching at one threshold does not depend on
+the others, and the AP / AR columns only average the COCO 0.5:0.95 thresholds.
+
+Usage:
+    python breakdown.py --gt <coco_gt.json> --pred <predictions.json> --output-dir <dir> [--iou-thr 0.2]
+    python breakdown.py --gt <coco_gt.json> --eval <results.npz> --output-dir <dir>
+"""
+
+import argparse
+import copy
+import csv
+import json
+import os
+
+import numpy as np
+
+from bootstrap import DET_STATS, bootstrap_eval, summary_stats
+from cocoeval import COCOeval
+from id_index import IdIndex
+
+COCO_IOU_THRS = np.linspace(.5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+VIDEO_STATS = ["AP", "AP50", "AP75", "AR1", "AR10", "AR100"]
+
+
+def with_iou_thr(iou_thrs, iou_thr):
+    """COCO IoU thresholds with iou_thr added (sorted)."""
+    return np.unique(np.r_[iou_thrs, iou_thr])
+
+
+def _thr_index(params, iou_thr):
+    t = np.flatnonzero(np.isclose(params.iouThrs, iou_thr))
+    if len(t) == 0:
+        raise ValueError(f"IoU threshold {iou_thr} was not evaluated (iouThrs = {params.iouThrs})")
+    return t[0]
+
+
+def _coco_thr_indices(params):
+    """Indices of the COCO 0.5:0.95 thresholds, or all of them if the evaluation did not use those."""
+    t = [i for i, thr in enumerate(params.iouThrs) if np.isclose(COCO_IOU_THRS, thr).any()]
+    return t if len(t) == len(COCO_IOU_THRS) else list(range(len(params.iouThrs)))
+
+
+def _all_area(params):
+    return params.areaRngLbl.index("all") if "all" in params.areaRngLbl else 0
+
+
+def _gt_rows(coco_eval):
+    """Non ignored gt rows of the 'all' area range."""
+    gts = coco_eval.evalGts
+    return gts[(gts["areaIdx"] == _all_area(coco_eval._paramsEval)) & ~gts["ignore"]]
+
+
+def video_breakdown(coco_eval, iou_thr=0.2, stats=VIDEO_STATS):
+    """
+    AP / AR and recall at iou_thr of every video.
+
+    Returns:
+        list of dict: one row per video (videos without annotations nor detections included).
+    """
+    p = coco_eval._paramsEval
+    videos, names = IdIndex(p.imgIds).videos()
+    V = len(names)
+    sel = [s for s in DET_STATS if s[0] in stats]
+    settings = {(a, m) for _, _, _, area_rng, max_dets in sel
+                for a, lbl in enumerate(p.areaRngLbl) if lbl == area_rng
+                for m, md in enumerate(p.maxDets) if md == max_dets}
+
+    # one weight vector per video: the accumulate of that video alone
+    boot = bootstrap_eval(coco_eval, np.eye(V), videos, settings)
+    t_coco = _coco_thr_indices(p)
+    p_coco = copy.copy(p)
+    p_coco.iouThrs = p.iouThrs[t_coco]
+    values = summary_stats({"precision": boot["precision"][:, t_coco], "recall": boot["recall"][:, t_coco]},
+                           p_coco, sel)
+
+    t = _thr_index(p, iou_thr)
+    gts = _gt_rows(coco_eval)
+    gt_video = videos[gts["imgIdx"]]
+    n_gts = np.bincount(gt_video, minlength=V)
+    n_detected = np.bincount(gt_video, weights=gts["matches"][:, t] != 0, minlength=V)
+    dets = coco_eval.evalDets
+    dets = dets[dets["areaIdx"] == _all_area(p)]
+    n_dets = np.bincount(videos[dets["imgIdx"]], minlength=V)
+    n_images = np.bincount(videos, minlength=V)
+
+    rows = []
+    for v, name in enumerate(names):
+        row = {"video": name, "images": int(n_images[v]), "gt_boxes": int(n_gts[v]), "detections": int(n_dets[v])}
+        row.update({s[0]: float(values[v, i]) for i, s in enumerate(sel)})
+        row[f"recall@{iou_thr:g}"] = float(n_detected[v] / n_gts[v]) if n_gts[v] else -1.0
+        rows.append(row)
+    return rows
+
+
+def lesion_breakdown(coco_eval, gt_lesions, iou_thr=0.2):
+    """
+    Detection of every lesion over the frames where it is annotated.
+
+    Args:
+        coco_eval (COCOeval): Evaluated object.
+        gt_lesions (dict): gt annotation id -> lesion id (`unique_id`).
+        iou_thr (float): IoU threshold of the recall column (must be evaluated).
+
+    Returns:
+        list of dict: one row per lesion, sorted by video and lesion id.
+    """
+    p = coco_eval._paramsEval
+    videos, names = IdIndex(p.imgIds).videos()
+    gts = _gt_rows(coco_eval)
+    known = np.array([i in gt_lesions for i in gts["id"].tolist()], dtype=bool)
+    gts = gts[known]
+    lesions, lesion_idx = np.unique(np.array([str(gt_lesions[i]) for i in gts["id"].tolist()]),
+                                    return_inverse=True)
+    lesions, lesion_idx = lesions.tolist(), lesion_idx.reshape(-1)
+    L = len(lesions)
+    detected = gts["matches"] != 0
+    t = _thr_index(p, iou_thr)
+    t_coco = _coco_thr_indices(p)
+
+    n_frames = np.bincount(lesion_idx, minlength=L)
+    n_detected = np.bincount(lesion_idx, weights=detected[:, t], minlength=L)
+    n_detected_coco = np.bincount(lesion_idx, weights=detected[:, t_coco].mean(axis=1), minlength=L)
+    # video of the first annotated frame of the lesion
+    first = np.full(L, len(gts))
+    np.minimum.at(first, lesion_idx, np.arange(len(gts)))
+    video = [names[videos[gts["imgIdx"][i]]] for i in first]
+
+    rows = [{"video": video[i], "lesion": lesions[i], "frames": int(n_frames[i]),
+             f"detected@{iou_thr:g}": int(n_detected[i]),
+             f"recall@{iou_thr:g}": float(n_detected[i] / n_frames[i]),
+             "AR": float(n_detected_coco[i] / n_frames[i])} for i in range(L)]
+    return sorted(rows, key=lambda r: (r["video"], r["lesion"]))
+
+
+def load_gt_lesions(coco_json_path):
+    """gt annotation id -> unique_id of an exported COCO json (annotations without unique_id are skipped)."""
+    with open(coco_json_path, "r") as f:
+        data = json.load(f)
+    return {ann["id"]: ann["unique_id"] for ann in data["annotations"] if "unique_id" in ann}
+
+
+def write_table(rows, path):
+    """Write a list of dict rows to a CSV file and print it."""
+    if not rows:
+        print(f"No rows for {path}")
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    header = list(rows[0])
+    print("\n" + "".join(f"{h:>14}" for h in header))
+    for r in rows:
+        print("".join(f"{r[h]:>14.3f}" if isinstance(r[h], float) else f"{str(r[h]):>14}" for h in header))
+    print("Saved:", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gt", type=str, required=True, help="COCO GT json file (with unique_id annotations)")
+    parser.add_argument("--pred", type=str, help="Predictions json (COCO detection format)")
+    parser.add_argument("--eval", type=str, help="Evaluation results saved by COCOeval.saveEval (instead of --pred)")
+    parser.add_argument("--output-dir", type=str, required=True, help="Directory for per_video.csv and per_lesion.csv")
+    parser.add_argument("--iou-thr", type=float, default=0.2, help="IoU threshold of the recall columns")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.eval:
+        E = COCOeval.loadEval(args.eval)
+    else:
+        from pycocotools.coco import COCO
+        cocoGt = COCO(args.gt)
+        E = COCOeval(cocoGt, cocoGt.loadRes(args.pred), "bbox")
+        E.params.iouThrs = with_iou_thr(E.params.iouThrs, args.iou_thr)
+        E.evaluate()
+
+    write_table(video_breakdown(E, args.iou_thr), os.path.join(args.output_dir, "per_video.csv"))
+    write_table(lesion_breakdown(E, load_gt_lesions(args.gt), args.iou_thr),
+                os.path.join(args.output_dir, "per_lesion.csv"))
@@ -21,8 +21,307 @@ import numpy as np
 import datetime
 import time
 from collections import defaultdict
-from pycocotools import mask as maskUtils
 import copy
+import heapq
+import multiprocessing as mp
+
+try:  # imported from a package, e.g. cocoeval.py and id_index.py copied into utils/ of the yolov7 fork
+    from .id_index import IdIndex, video_id
+except ImportError:
+    from id_index import IdIndex, video_id
+
+try:
+    from pycocotools import mask as maskUtils  # only needed for iouType='segm'
+except ImportError:
+    maskUtils = None
+
+
+def bboxIou(d, g, iscrowd):
+    '''
+    IoU between [x,y,w,h] boxes, same result as pycocotools.mask.iou for boxes:
+    for crowd gts the union is the detection area.
+    :param d: [Dx4] detection boxes
+    :param g: [Gx4] ground truth boxes
+    :param iscrowd: [G] crowd flag of each gt
+    :return: [DxG] ious, or [] if there are no detections or no ground truths
+    '''
+    if len(d) == 0 or len(g) == 0:
+        return []
+    d = np.asarray(d, dtype=np.float64)
+    g = np.asarray(g, dtype=np.float64)
+    return _pairIou(d[:, None, :], g[None, :, :], np.asarray(iscrowd, dtype=bool)[None, :])
+
+
+def _pairIou(d, g, crowd):
+    # elementwise IoU of broadcastable [...x4] boxes, in the operation order of maskUtils
+    w = np.minimum(d[..., 2] + d[..., 0], g[..., 2] + g[..., 0]) - np.maximum(d[..., 0], g[..., 0])
+    h = np.minimum(d[..., 3] + d[..., 1], g[..., 3] + g[..., 1]) - np.maximum(d[..., 1], g[..., 1])
+    inter = w * h
+    da = d[..., 2] * d[..., 3]
+    union = np.where(crowd, da, da + g[..., 2] * g[..., 3] - inter)
+    ok = (w > 0) & (h > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(ok, inter / np.where(ok, union, 1), 0.0)
+
+
+def batchedBboxIou(dtBoxes, dtCounts, gtBoxes, gtCounts, gtCrowd):
+    '''
+    Compute the bbox IoU matrices of many images in one vectorized pass.
+    Boxes of all the images are concatenated, image after image.
+    :param dtBoxes: [Nx4] detection boxes [x,y,w,h]
+    :param dtCounts: [n] number of detections of each image
+    :param gtBoxes: [Mx4] ground truth boxes [x,y,w,h]
+    :param gtCounts: [n] number of ground truths of each image
+    :param gtCrowd: [M] crowd flag of each gt
+    :return: list of n [DixGi] iou matrices ([] for images without dt or gt)
+    '''
+    dtCounts = np.asarray(dtCounts, dtype=np.int64)
+    gtCounts = np.asarray(gtCounts, dtype=np.int64)
+    dtStart = np.cumsum(dtCounts) - dtCounts
+    gtStart = np.cumsum(gtCounts) - gtCounts
+    # enumerate the dt/gt pairs of every image, dt major
+    pairCounts = dtCounts * gtCounts
+    pairImg = np.repeat(np.arange(len(pairCounts)), pairCounts)
+    local = np.arange(pairCounts.sum()) - np.repeat(np.cumsum(pairCounts) - pairCounts, pairCounts)
+    dind = dtStart[pairImg] + local // gtCounts[pairImg]
+    gind = gtStart[pairImg] + local % gtCounts[pairImg]
+    gtBoxes = np.asarray(gtBoxes, dtype=np.float64).reshape(-1, 4)
+    dtBoxes = np.asarray(dtBoxes, dtype=np.float64).reshape(-1, 4)
+    ious = _pairIou(dtBoxes[dind], gtBoxes[gind], np.asarray(gtCrowd, dtype=bool)[gind])
+    ious = np.split(ious, np.cumsum(pairCounts)[:-1])
+    return [iou.reshape(nd, ng) if nd and ng else [] for iou, nd, ng in zip(ious, dtCounts, gtCounts)]
+
+
+def videoShards(imgIds, n):
+    '''
+    Split image ids in about n balanced shards, keeping the frames of a video together.
+    REAL-Colon image ids look like "001-010_18185", the video being the part before "_";
+    videos larger than a shard are cut in contiguous chunks.
+    :return: list of lists of image ids
+    '''
+    videos = defaultdict(list)
+    for imgId in imgIds:
+        videos[video_id(imgId)].append(imgId)
+    size = max(1, int(np.ceil(len(imgIds) / n)))
+    chunks = [ids[i:i + size] for ids in videos.values() for i in range(0, len(ids), size)]
+    # largest chunks first, each one to the currently smallest shard
+    shards = [(0, s, []) for s in range(min(n, len(chunks)))]
+    for chunk in sorted(chunks, key=len, reverse=True):
+        count, s, ids = heapq.heappop(shards)
+        ids.extend(chunk)
+        heapq.heappush(shards, (count + len(chunk), s, ids))
+    return [ids for _, _, ids in sorted(shards, key=lambda x: x[1]) if ids]
+
+
+EVAL_FILE_VERSION = 1  # layout of the files written by COCOeval.saveEval
+
+
+def evalDtypes(T):
+    '''
+    Row types of the compact per image evaluation tables for T IoU thresholds
+    :return: (detection row dtype, ground truth row dtype)
+    '''
+    key = [('catIdx', np.int32), ('areaIdx', np.int32), ('imgIdx', np.int64)]
+    dets = np.dtype(key + [('rank', np.int32), ('id', np.int64), ('score', np.float64),
+                           ('matches', np.int64, (T,)), ('ignore', np.bool_, (T,))])
+    gts = np.dtype(key + [('id', np.int64), ('ignore', np.bool_), ('matches', np.int64, (T,))])
+    return dets, gts
+
+
+def evalTables(results, T):
+    '''
+    Pack evaluateImg results into two tables with one row per detection / ground truth:
+     evalDets - catIdx, areaIdx, imgIdx, rank (score order in the image), id, score,
+                matches [T] (matched gt id or 0) and ignore [T]
+     evalGts  - catIdx, areaIdx, imgIdx, id, ignore and matches [T] (matched dt id or 0)
+    Rows are ordered by category, area range, image and rank, as accumulate expects.
+    :param results: list of (category index, area range index, image index, evaluateImg dict)
+    :param T: number of IoU thresholds
+    :return: (evalDets, evalGts) structured arrays
+    '''
+    results = [r for r in results if r[3] is not None]
+    detType, gtType = evalDtypes(T)
+    nd = np.array([len(e['dtIds']) for _, _, _, e in results], dtype=np.int64)
+    ng = np.array([len(e['gtIds']) for _, _, _, e in results], dtype=np.int64)
+    dets = np.zeros(nd.sum(), dtype=detType)
+    gts = np.zeros(ng.sum(), dtype=gtType)
+    if len(results) == 0:
+        return dets, gts
+    for table, n in ((dets, nd), (gts, ng)):
+        for f, c in zip(('catIdx', 'areaIdx', 'imgIdx'), zip(*results)):
+            table[f] = np.repeat(c, n)
+    dets['rank'] = np.arange(len(dets)) - np.repeat(np.cumsum(nd) - nd, nd)
+    dets['id'] = np.concatenate([e['dtIds'] for _, _, _, e in results])
+    dets['score'] = np.concatenate([e['dtScores'] for _, _, _, e in results])
+    dets['matches'] = np.concatenate([np.reshape(e['dtMatches'], (T, -1)).T for _, _, _, e in results])
+    dets['ignore'] = np.concatenate([np.reshape(e['dtIgnore'], (T, -1)).T for _, _, _, e in results])
+    gts['id'] = np.concatenate([e['gtIds'] for _, _, _, e in results])
+    gts['ignore'] = np.concatenate([e['gtIgnore'] for _, _, _, e in results])
+    gts['matches'] = np.concatenate([np.reshape(e['gtMatches'], (T, -1)).T for _, _, _, e in results])
+    return sortEvalTable(dets), sortEvalTable(gts)
+
+
+def sortEvalTable(table):
+    # stable order by category, area range, image and rank in the image
+    keys = [table[f] for f in ('rank', 'imgIdx', 'areaIdx', 'catIdx') if f in table.dtype.names]
+    return table[np.lexsort(keys)]
+
+
+def mergeEvalTables(dets, gts, T):
+    '''
+    Concatenate evaluation tables of disjoint image subsets, in the evalTables order
+    '''
+    detType, gtType = evalDtypes(T)
+    dets = np.concatenate([np.zeros(0, dtype=detType)] + list(dets))
+    gts = np.concatenate([np.zeros(0, dtype=gtType)] + list(gts))
+    return sortEvalTable(dets), sortEvalTable(gts)
+
+
+def recallCounts(npig, recThrs):
+    '''
+    Smallest number of true positives c[r] with c[r] / npig >= recThrs[r]
+    :param npig: number of non ignored gts
+    :param recThrs: [R] recall thresholds
+    :return: [R] int64 counts
+    '''
+    recThrs = np.asarray(recThrs, dtype=float)
+    c = np.ceil(recThrs * npig).astype(np.int64)
+    # c / npig is monotone in c: fix the rounding of the product in both directions
+    c -= (c - 1) / npig >= recThrs
+    c += c / npig < recThrs
+    return c
+
+
+def precisionAtRecall(tps, fps, npig, dtScores, recThrs):
+    '''
+    Interpolated precision and score at each recall threshold, for all the IoU thresholds at once
+    :param tps: [TxD] true positive flags of the detections sorted by decreasing score
+    :param fps: [TxD] false positive flags of the same detections
+    :param npig: number of non ignored gts
+    :param dtScores: [D] sorted detection scores
+    :param recThrs: [R] recall thresholds
+    :return: (precision [TxR], scores [TxR], recall [T]), 0 where the recall is not reached
+    '''
+    T, D = tps.shape
+    R = len(recThrs)
+    if D == 0:
+        return np.zeros((T, R)), np.zeros((T, R)), np.zeros(T)
+    tp = np.cumsum(tps, axis=1)
+    fp = np.cumsum(fps, axis=1)
+    pr = tp / (fp + tp + np.spacing(1))
+    # precision envelope: running max from the lowest scores up
+    pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+
+    # first detection with rc >= recThr, i.e. with tp >= c: the c-th true positive of each row
+    # (integer counts, so exactly the comparisons of a searchsorted on rc)
+    c = recallCounts(npig, recThrs)[None]
+    ntp = tp[:, -1:]
+    reached = c <= ntp
+    cols = np.append(np.nonzero(tps)[1], 0)
+    inds = cols[np.where(reached & (c > 0), np.cumsum(ntp)[:, None] - ntp + c - 1, len(cols) - 1)]
+    q = np.where(reached, np.take_along_axis(pr, inds, axis=1), 0)
+    ss = np.where(reached, np.asarray(dtScores)[inds], 0)
+    return q, ss, tp[:, -1] / npig
+
+
+def _initShardWorker(cocoEval, catIds, computeIous=True):
+    global _shardEval, _shardCatIds, _shardComputeIous
+    _shardEval, _shardCatIds, _shardComputeIous = cocoEval, catIds, computeIous
+
+
+def _evaluateShardWorker(pairs):
+    return _shardEval._evaluateShard(pairs, _shardCatIds, _shardComputeIous)
+
+
+def greedyMatch(ious, gtIg, iscrowd, iouThrs):
+    '''
+    Greedily match detections (sorted by score) to ground truths for all the IoU
+    thresholds at once, with array operations instead of Python loops.
+    Each detection takes the best available gt, preferring regular gts over ignored
+    ones; crowd gts can be matched many times. Gives the same matches as the
+    reference loop in greedyMatchLoop.
+    :param ious: [DxG] ious between detections and ground truths
+    :param gtIg: [G] ignore flag of each gt, or [TxG] a different flag for each threshold row
+    :param iscrowd: [G] crowd flag of each gt
+    :param iouThrs: [T] IoU thresholds
+    :return: dtMatch [TxD] and gtMatch [TxG], index of the matched gt/dt or -1
+    '''
+    ious = np.asarray(ious, dtype=np.float64)
+    T = len(iouThrs)
+    D, G = ious.shape
+    dtMatch = -np.ones((T, D), dtype=np.int64)
+    gtMatch = -np.ones((T, G), dtype=np.int64)
+    gtIg = np.broadcast_to(np.asarray(gtIg, dtype=bool), (T, G) if np.ndim(gtIg) > 1 else (1, G))
+    crowd = np.asarray(iscrowd, dtype=bool)
+    thrs = np.minimum(np.asarray(iouThrs, dtype=np.float64), 1 - 1e-10)
+    if D == 0 or G == 0:
+        return dtMatch, gtMatch
+    # preference rank of each gt for each detection: regular gts first, then best iou,
+    # then the last gt among ties, which is the gt the reference loop ends up with
+    # (on gts sorted ignore last; the rank does not depend on the gt order otherwise)
+    shape = (len(gtIg), D, G)
+    order = np.lexsort((np.broadcast_to(np.arange(G), shape), np.broadcast_to(ious, shape),
+                        np.broadcast_to(~gtIg[:, None], shape)), axis=-1)
+    pref = np.empty(shape, dtype=np.int64)
+    np.put_along_axis(pref, order, np.arange(G), axis=-1)
+    # [TxDxG] pairs above each threshold that are still available
+    cand = ious[None] >= thrs[:, None, None]
+    rows = np.arange(T)[:, None]
+    dind = np.arange(D)
+    # The picks of the detections only change when a non-crowd gt gets taken, so every
+    # step resolves, for all thresholds, the detections up to the next one taking a gt.
+    while True:
+        score = np.where(cand, pref, -1)
+        m = np.argmax(score, axis=2)
+        has = score.max(axis=2) > -1
+        takes = has & ~crowd[m]
+        last = np.where(takes.any(axis=1), np.argmax(takes, axis=1), D - 1)
+        ti, di = np.nonzero(has & (dind <= last[:, None]))
+        dtMatch[ti, di] = m[ti, di]
+        # crowd gts keep the last detection matched to them
+        np.maximum.at(gtMatch, (ti, m[ti, di]), di)
+        # drop the resolved detections and the taken gts
+        cand[dind[None, :] <= last[:, None]] = False
+        took = np.nonzero(takes[rows[:, 0], last])[0]
+        if len(took) == 0:
+            break
+        cand[took, :, m[took, last[took]]] = False
+    return dtMatch, gtMatch
+
+
+def greedyMatchLoop(ious, gtIg, iscrowd, iouThrs):
+    '''
+    Reference implementation of greedyMatch: the original COCO triple loop over
+    thresholds, detections and ground truths. Kept to check the vectorized matcher.
+    '''
+    T = len(iouThrs)
+    D, G = np.shape(ious)
+    dtMatch = -np.ones((T, D), dtype=np.int64)
+    gtMatch = -np.ones((T, G), dtype=np.int64)
+    for tind, t in enumerate(iouThrs):
+        for dind in range(D):
+            # information about best match so far (m=-1 -> unmatched)
+            iou = min([t, 1 - 1e-10])
+            m = -1
+            for gind in range(G):
+                # if this gt already matched, and not a crowd, continue
+                if gtMatch[tind, gind] > -1 and not iscrowd[gind]:
+                    continue
+                # if dt matched to reg gt, and on ignore gt, stop
+                if m > -1 and gtIg[m] == 0 and gtIg[gind] == 1:
+                    break
+                # continue to next gt unless better match made
+                if ious[dind, gind] < iou:
+                    continue
+                # if match successful and best so far, store appropriately
+                iou = ious[dind, gind]
+                m = gind
+            # if match made store id of match for both dt and gt
+            if m == -1:
+                continue
+            dtMatch[tind, dind] = m
+            gtMatch[tind, m] = dind
+    return dtMatch, gtMatch
 
 
 class COCOeval:
@@ -50,18 +349,19 @@ class COCOeval:
     # Note: if useCats=0 category labels are ignored as in proposal scoring.
     # Note: multiple areaRngs [Ax2] and maxDets [Mx1] can be specified.
     #
-    # evaluate(): evaluates detections on every image and every category and
-    # concats the results into the "evalImgs" with fields:
-    #  dtIds      - [1xD] id for each of the D detections (dt)
-    #  gtIds      - [1xG] id for each of the G ground truths (gt)
-    #  dtMatches  - [TxD] matching gt id at each IoU or 0
-    #  gtMatches  - [TxG] matching dt id at each IoU or 0
-    #  dtScores   - [1xD] confidence of each dt
-    #  gtIgnore   - [1xG] ignore flag for each gt
-    #  dtIgnore   - [TxD] ignore flag for each dt at each IoU
+    # evaluate(): evaluates detections on every image and every category with
+    # at least one gt or dt and stores the results in two tables (see evalTables):
+    #  evalDets   - one row per detection (dt): catIdx, areaIdx, imgIdx, rank,
+    #               id, score, matches [T] (matching gt id or 0), ignore [T]
+    #  evalGts    - one row per ground truth (gt): catIdx, areaIdx, imgIdx,
+    #               id, ignore, matches [T] (matching dt id or 0)
+    # Images without any gt or dt (negative frames) take no storage.
+    # Internally images are referred to by imgIdx, their position in params.imgIds
+    # (see id_index.IdIndex, built in _prepare as self.imgIndex): _gts, _dts and ious
+    # are keyed by (imgIdx, catId), and imgIndex.decode maps indices back to ids.
     #
     # accumulate(): accumulates the per-image, per-category evaluation
-    # results in "evalImgs" into the dictionary "eval" with fields:
+    # results in "evalDets" / "evalGts" into the dictionary "eval" with fields:
     #  params     - parameters used for evaluation
     #  date       - date evaluation was performed
     #  counts     - [T,R,K,A,M] parameter dimensions (see above)
@@ -86,10 +386,13 @@ class COCOeval:
             print('iouType not specified. use default iouType segm')
         self.cocoGt = cocoGt  # ground truth COCO API
         self.cocoDt = cocoDt  # detections COCO API
-        self.evalImgs = defaultdict(list)  # per-image per-category evaluation results [KxAxI] elements
+        self.evalDets = None  # per detection evaluation results
+        self.evalGts = None  # per ground truth evaluation results
         self.eval = {}  # accumulated evaluation results
         self._gts = defaultdict(list)  # gt for evaluation
         self._dts = defaultdict(list)  # dt for evaluation
+        self.imgIndex = None  # IdIndex of params.imgIds, keys of _gts / _dts / ious
+        self.gtIndex = None  # prepared gts, can be shared with other dts (see prepareGts)
         self.params = Params(iouType=iouType)  # parameters
         self._paramsEval = {}  # parameters for evaluation
         self.stats = []  # result summarization
@@ -113,38 +416,87 @@ class COCOeval:
 
         p = self.params
         if p.useCats:
-            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
             dts = self.cocoDt.loadAnns(self.cocoDt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
         else:
-            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds))
             dts = self.cocoDt.loadAnns(self.cocoDt.getAnnIds(imgIds=p.imgIds))
+        if p.iouType == 'segm':
+            _toMask(dts, self.cocoDt)
+
+        # gts and dts are indexed by the position of their image in p.imgIds
+        gtIndex = self.gtIndex
+        if gtIndex is None or gtIndex['key'] != self._gtKey():
+            gtIndex = self.prepareGts()
+        self.imgIndex = gtIndex['imgIndex']
+        self._gts = defaultdict(list, gtIndex['gts'])  # gt for evaluation
+        self._dts = defaultdict(list)  # dt for evaluation
+        for i, dt in zip(self.imgIndex.encode([dt['image_id'] for dt in dts]), dts):
+            self._dts[i, dt['category_id']].append(dt)
+        self.evalDets = None  # per detection evaluation results
+        self.evalGts = None  # per ground truth evaluation results
+        self.eval = {}  # accumulated evaluation results
+
+    def _gtKey(self):
+        p = self.params
+        return (p.iouType, p.useCats, tuple(p.imgIds), tuple(p.catIds))
+
+    def prepareGts(self):
+        '''
+        Load, flag and index the gts of the current params, and keep them in self.gtIndex.
+        The index only depends on cocoGt and (iouType, useCats, imgIds, catIds): it can be
+        assigned to the gtIndex of other COCOeval objects evaluating other dts on the same gt
+        (e.g. evaluations of several models forked from one process, see batch_eval.py),
+        whose evaluate() then only prepares the dts
+        :return: dict with the params key, imgIndex and gts ((imgIdx, catId) -> list of gts)
+        '''
+        p = self.params
+        if p.useCats:
+            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
+        else:
+            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds))
 
         # convert ground truth to mask if iouType == 'segm'
         if p.iouType == 'segm':
-            _toMask(gts, self.cocoGt)
-            _toMask(dts, self.cocoDt)
+            for gt in gts:
+                gt['segmentation'] = self.cocoGt.annToRLE(gt)
         # set ignore flag
         for gt in gts:
             gt['ignore'] = gt['ignore'] if 'ignore' in gt else 0
             gt['ignore'] = 'iscrowd' in gt and gt['iscrowd']
             if p.iouType == 'keypoints':
                 gt['ignore'] = (gt['num_keypoints'] == 0) or gt['ignore']
-        self._gts = defaultdict(list)  # gt for evaluation
-        self._dts = defaultdict(list)  # dt for evaluation
-        for gt in gts:
-            self._gts[gt['image_id'], gt['category_id']].append(gt)
-        for dt in dts:
-            self._dts[dt['image_id'], dt['category_id']].append(dt)
-        self.evalImgs = defaultdict(list)  # per-image per-category evaluation results
-        self.eval = {}  # accumulated evaluation results
+        imgIndex = IdIndex(p.imgIds)
+        index = defaultdict(list)
+        for i, gt in zip(imgIndex.encode([gt['image_id'] for gt in gts]), gts):
+            index[i, gt['category_id']].append(gt)
+        self.gtIndex = {'key': self._gtKey(), 'imgIndex': imgIndex, 'gts': dict(index)}
+        return self.gtIndex
 
-    def evaluate(self):
+    def evaluate(self, workers=0):
         '''
-        Run per image evaluation on given images and store results (a list of dict) in self.evalImgs
+        Run per image evaluation on given images and store results in self.evalDets / self.evalGts
+        :param workers: if > 1, shard the images by video over a pool of worker processes
         :return: None
         '''
         tic = time.time()
         print('Running per image evaluation...')
+        p = self._checkParams()
+
+        self._prepare()
+        # loop through images, area range, max detection number
+        catIds = p.catIds if p.useCats else [-1]
+
+        # only the images with at least one gt or dt are evaluated
+        pairs = self._nonEmptyPairs(catIds)
+        self._evaluatePairs(pairs, catIds, workers)
+        self._paramsEval = copy.deepcopy(self.params)
+        toc = time.time()
+        print('DONE (t={:0.2f}s).'.format(toc - tic))
+
+    def _checkParams(self):
+        '''
+        Normalize the parameters before an evaluation
+        :return: params
+        '''
         p = self.params
         # add backward compatibility if useSegm is specified in params
         if not p.useSegm is None:
@@ -156,38 +508,126 @@ class COCOeval:
             p.catIds = list(np.unique(p.catIds))
         p.maxDets = sorted(p.maxDets)
         self.params = p
+        return p
 
-        self._prepare()
-        # loop through images, area range, max detection number
-        catIds = p.catIds if p.useCats else [-1]
+    def _evaluatePairs(self, pairs, catIds, workers=0, computeIous=True):
+        '''
+        Fill self.evalDets / self.evalGts (and self.ious unless computeIous is False, to reuse
+        the current ones) for the given (image index, category index) pairs
+        '''
+        if workers > 1:
+            self._evaluateParallel(pairs, catIds, workers, computeIous)
+        else:
+            ious, self.evalDets, self.evalGts = self._evaluateShard(pairs, catIds, computeIous)
+            if computeIous:
+                self.ious = ious
+
+    def _nonEmptyPairs(self, catIds):
+        '''
+        List the (image index, category index) pairs with at least one gt or dt
+        :return: sorted list of (i, k), indices in params.imgIds and catIds
+        '''
+        p = self.params
+        catIdx = {catId: k for k, catId in enumerate(catIds)}
+        pairs = set()
+        for anns in (self._gts, self._dts):
+            for (i, catId), a in anns.items():
+                if len(a) and (catId in catIdx or not p.useCats):
+                    pairs.add((i, catIdx[catId] if p.useCats else 0))
+        return sorted(pairs)
 
+    def _computeIoUs(self, keys):
+        p = self.params
         if p.iouType == 'segm' or p.iouType == 'bbox':
-            computeIoU = self.computeIoU
+            return self.computeIoUs(keys)
         elif p.iouType == 'keypoints':
-            computeIoU = self.computeOks
-        self.ious = {(imgId, catId): computeIoU(imgId, catId) \
-                     for imgId in p.imgIds
-                     for catId in catIds}
+            return {(i, catId): self.computeOks(i, catId) for i, catId in keys}
 
-        evaluateImg = self.evaluateImg
+    def _evaluateShard(self, pairs, catIds, computeIous=True):
+        '''
+        Compute ious and per image results for a subset of the (image, category) pairs
+        :return: (ious or None if computeIous is False, evalDets, evalGts)
+        '''
+        p = self.params
+        if computeIous:
+            self.ious = self._computeIoUs([(i, catIds[k]) for i, k in pairs])
         maxDet = p.maxDets[-1]
-        self.evalImgs = [evaluateImg(imgId, catId, areaRng, maxDet)
-                         for catId in catIds
-                         for areaRng in p.areaRng
-                         for imgId in p.imgIds
-                         ]
-        self._paramsEval = copy.deepcopy(self.params)
-        toc = time.time()
-        print('DONE (t={:0.2f}s).'.format(toc - tic))
+        results = [(k, a, i, e)
+                   for i, k in pairs
+                   for a, e in enumerate(self.evaluateImgAreas(i, catIds[k], p.areaRng, maxDet))]
+        return (self.ious if computeIous else None,) + evalTables(results, len(p.iouThrs))
+
+    def _evaluateParallel(self, pairs, catIds, workers, computeIous=True):
+        '''
+        Run the per image evaluation of video shards in worker processes and merge the
+        results back in the order expected by accumulate
+        '''
+        p = self.params
+        imgs = sorted(set(i for i, _ in pairs))
+        shardOf = {}
+        for s, ids in enumerate(videoShards([p.imgIds[i] for i in imgs], workers * 4)):
+            shardOf.update((imgId, s) for imgId in ids)
+        shards = defaultdict(list)
+        for i, k in pairs:
+            shards[shardOf[p.imgIds[i]]].append((i, k))
+        shards = [shards[s] for s in sorted(shards)]
+        ctx = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else None)
+        with ctx.Pool(max(1, min(workers, len(shards))), initializer=_initShardWorker,
+                      initargs=(self, catIds, computeIous)) as pool:
+            results = pool.map(_evaluateShardWorker, shards)
+        if computeIous:
+            self.ious = {}
+            for ious, _, _ in results:
+                self.ious.update(ious)
+        self.evalDets, self.evalGts = mergeEvalTables([r[1] for r in results], [r[2] for r in results],
+                                                      len(p.iouThrs))
 
-    def computeIoU(self, imgId, catId):
+    def _getGtDt(self, imgIdx, catId):
         p = self.params
         if p.useCats:
-            gt = self._gts[imgId, catId]
-            dt = self._dts[imgId, catId]
+            gt = self._gts[imgIdx, catId]
+            dt = self._dts[imgIdx, catId]
         else:
-            gt = [_ for cId in p.catIds for _ in self._gts[imgId, cId]]
-            dt = [_ for cId in p.catIds for _ in self._dts[imgId, cId]]
+            gt = [_ for cId in p.catIds for _ in self._gts[imgIdx, cId]]
+            dt = [_ for cId in p.catIds for _ in self._dts[imgIdx, cId]]
+        return gt, dt
+
+    def computeIoUs(self, keys):
+        '''
+        Compute the ious of many (imgIdx, catId) pairs, batched over all the images for bbox
+        :param keys: list of (index of the image in params.imgIds, category id)
+        :return: dict (imgIdx, catId) -> ious, as computeIoU
+        '''
+        p = self.params
+        if p.iouType != 'bbox':
+            return {(i, catId): self.computeIoU(i, catId) for i, catId in keys}
+
+        dtBoxes, dtScores, dtCounts, gtBoxes, gtCrowd, gtCounts = [], [], [], [], [], []
+        for i, catId in keys:
+            gt, dt = self._getGtDt(i, catId)
+            dtBoxes.extend(d['bbox'] for d in dt)
+            dtScores.extend(d['score'] for d in dt)
+            dtCounts.append(len(dt))
+            gtBoxes.extend(g['bbox'] for g in gt)
+            gtCrowd.extend(int(g['iscrowd']) for g in gt)
+            gtCounts.append(len(gt))
+
+        # sort dt highest score first within each image and keep the first maxDets[-1]
+        dtCounts = np.array(dtCounts, dtype=np.int64)
+        dtImg = np.repeat(np.arange(len(keys)), dtCounts)
+        inds = np.argsort(-np.array(dtScores, dtype=np.float64), kind='mergesort')
+        inds = inds[np.argsort(dtImg[inds], kind='mergesort')]
+        rank = np.arange(len(inds)) - np.repeat(np.cumsum(dtCounts) - dtCounts, dtCounts)
+        inds = inds[rank < p.maxDets[-1]]
+        dtCounts = np.minimum(dtCounts, p.maxDets[-1])
+
+        ious = batchedBboxIou(np.array(dtBoxes, dtype=np.float64).reshape(-1, 4)[inds], dtCounts,
+                              gtBoxes, gtCounts, gtCrowd)
+        return dict(zip(keys, ious))
+
+    def computeIoU(self, imgIdx, catId):
+        p = self.params
+        gt, dt = self._getGtDt(imgIdx, catId)
         if len(gt) == 0 and len(dt) == 0:
             return []
         inds = np.argsort([-d['score'] for d in dt], kind='mergesort')
@@ -206,14 +646,18 @@ class COCOeval:
 
         # compute iou between each dt and gt region
         iscrowd = [int(o['iscrowd']) for o in gt]
+        if p.iouType == 'bbox':
+            return bboxIou(d, g, iscrowd)
+        if maskUtils is None:
+            raise ImportError('pycocotools is required for segm evaluation')
         ious = maskUtils.iou(d, g, iscrowd)
         return ious
 
-    def computeOks(self, imgId, catId):
+    def computeOks(self, imgIdx, catId):
         p = self.params
         # dimention here should be Nxm
-        gts = self._gts[imgId, catId]
-        dts = self._dts[imgId, catId]
+        gts = self._gts[imgIdx, catId]
+        dts = self._dts[imgIdx, catId]
         inds = np.argsort([-d['score'] for d in dts], kind='mergesort')
         dts = [dts[i] for i in inds]
         if len(dts) > p.maxDets[-1]:
@@ -262,81 +706,75 @@ class COCOeval:
         perform evaluation for single category and image
         :return: dict (single image results)
         '''
+        return self.evaluateImgAreas(self.imgIndex.code(imgId), catId, [aRng], maxDet)[0]
+
+    def evaluateImgAreas(self, imgIdx, catId, areaRng, maxDet):
+        '''
+        perform evaluation for single category and image over several area ranges:
+        the detections are sorted and matched once, for all the area ranges together
+        :param imgIdx: index of the image in params.imgIds (imgIndex code of its id)
+        :param areaRng: [Ax2] area ranges
+        :return: list of A dicts (single image results for each area range), or A Nones
+        '''
         p = self.params
-        if p.useCats:
-            gt = self._gts[imgId, catId]
-            dt = self._dts[imgId, catId]
-        else:
-            gt = [_ for cId in p.catIds for _ in self._gts[imgId, cId]]
-            dt = [_ for cId in p.catIds for _ in self._dts[imgId, cId]]
+        gt, dt = self._getGtDt(imgIdx, catId)
         if len(gt) == 0 and len(dt) == 0:
-            return None
+            return [None] * len(areaRng)
 
-        for g in gt:
-            if g['ignore'] or (g['area'] < aRng[0] or g['area'] > aRng[1]):
-                g['_ignore'] = 1
-            else:
-                g['_ignore'] = 0
-
-        # sort dt highest score first, sort gt ignore last
-        gtind = np.argsort([g['_ignore'] for g in gt], kind='mergesort')
-        gt = [gt[i] for i in gtind]
+        # sort dt highest score first
         dtind = np.argsort([-d['score'] for d in dt], kind='mergesort')
         dt = [dt[i] for i in dtind[0:maxDet]]
-        iscrowd = [int(o['iscrowd']) for o in gt]
-        # load computed ious
-        ious = self.ious[imgId, catId][:, gtind] if len(self.ious[imgId, catId]) > 0 else self.ious[imgId, catId]
-
+        aRng = np.asarray(areaRng, dtype=float).reshape(-1, 2)
+        A = len(aRng)
         T = len(p.iouThrs)
         G = len(gt)
         D = len(dt)
-        gtm = np.zeros((T, G))
-        dtm = np.zeros((T, D))
-        gtIg = np.array([g['_ignore'] for g in gt])
-        dtIg = np.zeros((T, D))
+        # [AxG] ignore flags of each area range, gts kept in their original order
+        gtArea = np.array([g['area'] for g in gt], dtype=float)
+        gtIgAll = np.array([bool(g['ignore']) for g in gt], dtype=bool)
+        gtIg = gtIgAll | (gtArea < aRng[:, :1]) | (gtArea > aRng[:, 1:])
+        iscrowd = [int(o['iscrowd']) for o in gt]
+        gtIds = np.array([g['id'] for g in gt])
+        dtIds = np.array([d['id'] for d in dt])
+        # load computed ious
+        ious = self.ious[imgIdx, catId]
+
+        # one [A*T] row per (area range, threshold)
+        gtm = np.zeros((A * T, G))
+        dtm = np.zeros((A * T, D))
+        dtIg = np.zeros((A * T, D), dtype=bool)
+        rowIg = np.repeat(gtIg, T, axis=0)
         if not len(ious) == 0:
-            for tind, t in enumerate(p.iouThrs):
-                for dind, d in enumerate(dt):
-                    # information about best match so far (m=-1 -> unmatched)
-                    iou = min([t, 1 - 1e-10])
-                    m = -1
-                    for gind, g in enumerate(gt):
-                        # if this gt already matched, and not a crowd, continue
-                        if gtm[tind, gind] > 0 and not iscrowd[gind]:
-                            continue
-                        # if dt matched to reg gt, and on ignore gt, stop
-                        if m > -1 and gtIg[m] == 0 and gtIg[gind] == 1:
-                            break
-                        # continue to next gt unless better match made
-                        if ious[dind, gind] < iou:
-                            continue
-                        # if match successful and best so far, store appropriately
-                        iou = ious[dind, gind]
-                        m = gind
-                    # if match made store id of match for both dt and gt
-                    if m == -1:
-                        continue
-                    dtIg[tind, dind] = gtIg[m]
-                    dtm[tind, dind] = gt[m]['id']
-                    gtm[tind, m] = d['id']
+            dtMatch, gtMatch = greedyMatch(ious, rowIg, iscrowd, np.tile(p.iouThrs, A))
+            matched = dtMatch > -1
+            dtm[matched] = gtIds[dtMatch[matched]]
+            dtIg[matched] = np.take_along_axis(rowIg, np.maximum(dtMatch, 0), axis=1)[matched]
+            matched = gtMatch > -1
+            gtm[matched] = dtIds[gtMatch[matched]]
         # set unmatched detections outside of area range to ignore
-        a = np.array([d['area'] < aRng[0] or d['area'] > aRng[1] for d in dt]).reshape((1, len(dt)))
-        dtIg = np.logical_or(dtIg, np.logical_and(dtm == 0, np.repeat(a, T, 0)))
-
-        # store results for given image and category
-        return {
-            'image_id': imgId,
-            'category_id': catId,
-            'aRng': aRng,
-            'maxDet': maxDet,
-            'dtIds': [d['id'] for d in dt],
-            'gtIds': [g['id'] for g in gt],
-            'dtMatches': dtm,
-            'gtMatches': gtm,
-            'dtScores': [d['score'] for d in dt],
-            'gtIgnore': gtIg,
-            'dtIgnore': dtIg,
-        }
+        dtArea = np.array([d['area'] for d in dt], dtype=float)
+        out = np.repeat((dtArea < aRng[:, :1]) | (dtArea > aRng[:, 1:]), T, axis=0)
+        dtIg = np.logical_or(dtIg, np.logical_and(dtm == 0, out))
+
+        # store results for given image and category, gts sorted ignore last
+        results = []
+        for a in range(A):
+            gtind = np.argsort(gtIg[a], kind='mergesort')
+            rows = slice(a * T, (a + 1) * T)
+            results.append({
+                'image_id': p.imgIds[imgIdx],
+                'category_id': catId,
+                'aRng': areaRng[a],
+                'maxDet': maxDet,
+                'dtIds': [d['id'] for d in dt],
+                'gtIds': [gt[i]['id'] for i in gtind],
+                'dtMatches': dtm[rows],
+                'gtMatches': gtm[rows][:, gtind],
+                'dtScores': [d['score'] for d in dt],
+                'gtIgnore': gtIg[a][gtind],
+                'dtIgnore': dtIg[rows],
+            })
+        return results
 
     def accumulate(self, p=None):
         '''
@@ -346,7 +784,7 @@ class COCOeval:
         '''
         print('Accumulating evaluation results...')
         tic = time.time()
-        if not self.evalImgs:
+        if self.evalDets is None:
             print('Please run evaluate() first')
         # allows input customized parameters
         if p is None:
@@ -373,68 +811,43 @@ class COCOeval:
         m_list = [m for n, m in enumerate(p.maxDets) if m in setM]
         a_list = [n for n, a in enumerate(map(lambda x: tuple(x), p.areaRng)) if a in setA]
         i_list = [n for n, i in enumerate(p.imgIds) if i in setI]
-        I0 = len(_pe.imgIds)
         A0 = len(_pe.areaRng)
-        # retrieve E at each category, area range, and max number of detections
+        imgSel = np.zeros(len(_pe.imgIds), dtype=bool)
+        imgSel[[i for i in i_list if i < len(imgSel)]] = True
+        # the tables are sorted by category and area range: find the rows of each (k0, a0)
+        dets, gts = self.evalDets, self.evalGts
+        dtGroup = dets['catIdx'].astype(np.int64) * A0 + dets['areaIdx']
+        gtGroup = gts['catIdx'].astype(np.int64) * A0 + gts['areaIdx']
+        # retrieve the rows at each category, area range, and max number of detections
         for k, k0 in enumerate(k_list):
-            Nk = k0 * A0 * I0
             for a, a0 in enumerate(a_list):
-                Na = a0 * I0
+                g0 = k0 * A0 + a0
+                gt = gts[np.searchsorted(gtGroup, g0, 'left'):np.searchsorted(gtGroup, g0, 'right')]
+                npig = np.count_nonzero(~gt['ignore'][imgSel[gt['imgIdx']]])
+                if npig == 0:
+                    continue
+                lo, hi = np.searchsorted(dtGroup, g0, 'left'), np.searchsorted(dtGroup, g0, 'right')
+                rows = lo + np.flatnonzero(imgSel[dets['imgIdx'][lo:hi]])
                 for m, maxDet in enumerate(m_list):
-                    E = [self.evalImgs[Nk + Na + i] for i in i_list]
-                    E = [e for e in E if not e is None]
-                    if len(E) == 0:
-                        continue
-                    dtScores = np.concatenate([e['dtScores'][0:maxDet] for e in E])
+                    E = rows[dets['rank'][rows] < maxDet]
+                    dtScores = dets['score'][E]
 
                     # different sorting method generates slightly different results.
                     # mergesort is used to be consistent as Matlab implementation.
                     inds = np.argsort(-dtScores, kind='mergesort')
                     dtScoresSorted = dtScores[inds]
 
-                    dtm = np.concatenate([e['dtMatches'][:, 0:maxDet] for e in E], axis=1)[:, inds]
-                    dtIg = np.concatenate([e['dtIgnore'][:, 0:maxDet] for e in E], axis=1)[:, inds]
-                    gtIg = np.concatenate([e['gtIgnore'] for e in E])
-                    npig = np.count_nonzero(gtIg == 0)
-                    if npig == 0:
-                        continue
-                    tps = np.logical_and(dtm, np.logical_not(dtIg))
-                    fps = np.logical_and(np.logical_not(dtm), np.logical_not(dtIg))
-
-                    tp_sum = np.cumsum(tps, axis=1).astype(dtype=float)
-                    fp_sum = np.cumsum(fps, axis=1).astype(dtype=float)
-                    for t, (tp, fp) in enumerate(zip(tp_sum, fp_sum)):
-                        tp = np.array(tp)
-                        fp = np.array(fp)
-                        nd = len(tp)
-                        rc = tp / npig
-                        pr = tp / (fp + tp + np.spacing(1))
-                        q = np.zeros((R,))
-                        ss = np.zeros((R,))
-
-                        if nd:
-                            recall[t, k, a, m] = rc[-1]
-                        else:
-                            recall[t, k, a, m] = 0
-
-                        # numpy is slow without cython optimization for accessing elements
-                        # use python array gets significant speed improvement
-                        pr = pr.tolist();
-                        q = q.tolist()
-
-                        for i in range(nd - 1, 0, -1):
-                            if pr[i] > pr[i - 1]:
-                                pr[i - 1] = pr[i]
-
-                        inds = np.searchsorted(rc, p.recThrs, side='left')
-                        try:
-                            for ri, pi in enumerate(inds):
-                                q[ri] = pr[pi]
-                                ss[ri] = dtScoresSorted[pi]
-                        except:
-                            pass
-                        precision[t, :, k, a, m] = np.array(q)
-                        scores[t, :, k, a, m] = np.array(ss)
+                    # gather whole [T] rows, then work on contiguous [TxD] flags
+                    E = E[inds]
+                    dtm = dets['matches'][E] != 0
+                    dtIg = dets['ignore'][E]
+                    tps = np.ascontiguousarray(np.logical_and(dtm, np.logical_not(dtIg)).T)
+                    fps = np.ascontiguousarray(np.logical_and(np.logical_not(dtm), np.logical_not(dtIg)).T)
+
+                    q, ss, rc = precisionAtRecall(tps, fps, npig, dtScoresSorted, p.recThrs)
+                    precision[:, :, k, a, m] = q
+                    scores[:, :, k, a, m] = ss
+                    recall[:, k, a, m] = rc
         self.eval = {
             'params': p,
             'counts': [T, R, K, A, M],
@@ -530,6 +943,146 @@ class COCOeval:
     def __str__(self):
         self.summarize()
 
+    def saveEval(self, path, compress=True):
+        '''
+        Save the per image evaluation results (one array per column of evalDets / evalGts)
+        and the parameters they were computed with to a .npz file (no pickled objects),
+        to re-run accumulate / summarize later
+        :param path: output .npz file
+        :param compress: use np.savez_compressed (smaller file, slower save)
+        :return: None
+        '''
+        if self.evalDets is None:
+            raise Exception('Please run evaluate() first')
+        pe = self._paramsEval
+        arrays = {
+            'version': np.array(EVAL_FILE_VERSION),
+            'iouType': np.array(pe.iouType),
+            'imgIds': np.asarray(pe.imgIds),
+            'catIds': np.asarray(pe.catIds),
+            'iouThrs': np.asarray(pe.iouThrs, dtype=float),
+            'recThrs': np.asarray(pe.recThrs, dtype=float),
+            'maxDets': np.asarray(pe.maxDets, dtype=np.int64),
+            'areaRng': np.asarray(pe.areaRng, dtype=float).reshape(-1, 2),
+            'areaRngLbl': np.asarray(pe.areaRngLbl, dtype=str),
+            'useCats': np.array(int(pe.useCats)),
+        }
+        if pe.iouType == 'keypoints':
+            arrays['kpt_oks_sigmas'] = np.asarray(pe.kpt_oks_sigmas, dtype=float)
+        # one array per column of the tables
+        for name, table in (('evalDets', self.evalDets), ('evalGts', self.evalGts)):
+            for field in table.dtype.names:
+                arrays['{}.{}'.format(name, field)] = table[field]
+        (np.savez_compressed if compress else np.savez)(path, **arrays)
+
+    @classmethod
+    def loadEval(cls, path):
+        '''
+        Load results saved by saveEval in a new instance, ready for accumulate / summarize
+        :param path: .npz file written by saveEval
+        :return: evaluation object (without cocoGt / cocoDt)
+        '''
+        with np.load(path, allow_pickle=False) as f:
+            if int(f['version']) != EVAL_FILE_VERSION:
+                raise Exception('unsupported evaluation file version {}'.format(int(f['version'])))
+            E = cls(iouType=str(f['iouType']))
+            p = E.params
+            p.imgIds = f['imgIds'].tolist()
+            p.catIds = f['catIds'].tolist()
+            p.iouThrs = f['iouThrs']
+            p.recThrs = f['recThrs']
+            p.maxDets = f['maxDets'].tolist()
+            p.areaRng = f['areaRng'].tolist()
+            p.areaRngLbl = f['areaRngLbl'].tolist()
+            p.useCats = int(f['useCats'])
+            if 'kpt_oks_sigmas' in f:
+                p.kpt_oks_sigmas = f['kpt_oks_sigmas']
+            detType, gtType = evalDtypes(len(p.iouThrs))
+            for name, dtype in (('evalDets', detType), ('evalGts', gtType)):
+                table = np.empty(len(f['{}.id'.format(name)]), dtype=dtype)
+                for field in dtype.names:
+                    table[field] = f['{}.{}'.format(name, field)]
+                setattr(E, name, table)
+        E._paramsEval = copy.deepcopy(p)
+        return E
+
+
+class COCOevalSession(COCOeval):
+    # COCOeval that keeps its intermediate results between evaluate() calls, for
+    # parameter sweeps on the same gt and dt (e.g. iouThrs=[0.2] for the clinical
+    # metrics, then the COCO 0.5:0.95):
+    #  - the prepared gt/dt index, redone when imgIds, catIds, useCats or iouType change
+    #  - the ious, recomputed only when maxDets[-1] grows beyond the computed one
+    #    (dts are sorted by score, a smaller maxDets[-1] keeps the first rows)
+    #  - the per image matches, cached for each (iouThrs, areaRng, maxDets[-1])
+    # recThrs only affects accumulate(), which can be re-run directly after changing
+    # it; other changes (e.g. maxDets=[1, 5, 100]) need a new evaluate() call that only
+    # recomputes what they invalidate.
+    #
+    #  E = COCOevalSession(cocoGt, cocoDt, 'bbox')
+    #  E.evaluate(); E.accumulate(); E.summarize()
+    #  E.params.iouThrs = np.array([0.2]); E.evaluate(); E.accumulate()  # no new ious
+    def __init__(self, cocoGt=None, cocoDt=None, iouType='segm', maxCached=8):
+        '''
+        :param maxCached: number of match results kept (oldest dropped first)
+        '''
+        super().__init__(cocoGt, cocoDt, iouType)
+        self.maxCached = maxCached
+        self._prepKey = None  # parameters of the prepared index
+        self._pairs = []  # non empty (image index, category index) pairs of the index
+        self._iouKey = None  # (oks sigmas, maxDets[-1]) of self._allIous
+        self._allIous = {}
+        self._matches = {}  # (iouThrs, areaRng, maxDets[-1]) -> (evalDets, evalGts)
+
+    def evaluate(self, workers=0):
+        '''
+        Run per image evaluation, reusing what the parameter changes since the last call allow
+        :param workers: if > 1, shard the images by video over a pool of worker processes
+        :return: None
+        '''
+        tic = time.time()
+        print('Running per image evaluation...')
+        p = self._checkParams()
+        catIds = p.catIds if p.useCats else [-1]
+
+        prepKey = self._gtKey()
+        if prepKey != self._prepKey:
+            self._prepare()
+            self._pairs = self._nonEmptyPairs(catIds)
+            self._prepKey, self._iouKey, self._allIous, self._matches = prepKey, None, {}, {}
+        else:
+            print('Reusing prepared annotations')
+
+        maxDet = p.maxDets[-1]
+        sigmas = tuple(p.kpt_oks_sigmas) if p.iouType == 'keypoints' else None
+        computeIous = self._iouKey is None or self._iouKey[0] != sigmas or self._iouKey[1] < maxDet
+        if computeIous:
+            if self._iouKey is not None and self._iouKey[0] != sigmas:
+                # matches computed with other oks sigmas are stale
+                self._matches = {}
+        elif self._iouKey[1] > maxDet:
+            self.ious = {k: v[:maxDet] if len(v) else v for k, v in self._allIous.items()}
+        else:
+            self.ious = self._allIous
+
+        matchKey = (tuple(p.iouThrs), tuple(map(tuple, p.areaRng)), maxDet)
+        if matchKey in self._matches:
+            print('Reusing matches')
+            self.evalDets, self.evalGts = self._matches[matchKey]
+        else:
+            if not computeIous:
+                print('Reusing ious')
+            self._evaluatePairs(self._pairs, catIds, workers, computeIous)
+            if computeIous:
+                self._allIous, self._iouKey = self.ious, (sigmas, maxDet)
+            self._matches[matchKey] = (self.evalDets, self.evalGts)
+            while len(self._matches) > self.maxCached:
+                self._matches.pop(next(iter(self._matches)))
+        self.eval = {}
+        self._paramsEval = copy.deepcopy(p)
+        toc = time.time()
+        print('DONE (t={:0.2f}s).'.format(toc - tic))
+
 
 class Params:
     '''
@@ -0,0 +1,78 @@
+"""
+Dense integer codes for REAL-Colon image ids.
+
+The exported image ids are strings like "001-010_18185" (<video>_<frame>). Hashing
+and comparing these strings in every lookup is slow on millions of frames, so
+cocoeval.py and roc_universal.py intern them once at load time: the ids are
+sorted (the order of np.unique) and each one is replaced by its position. All
+the internal indexing then runs on integer arrays, and the codes are mapped
+back to the original ids only for the outputs.
+"""
+
+import numpy as np
+
+
+def video_id(image_id):
+    """Video part of an image id: "001-010_18185" -> "001-010" (integer ids are their own video)."""
+    return str(image_id).split("_")[0]
+
+
+def frame_number(image_id):
+    """Frame part of an image id: "001-010_18185" -> 18185 (integer ids are their own frame number)."""
+    return int(str(image_id).rsplit("_", 1)[-1])
+
+
+class IdIndex:
+    """
+    Sorted set of image ids with vectorized id <-> code conversions.
+
+    Args:
+        ids (iterable): Image ids (strings or integers), duplicates allowed.
+    """
+
+    def __init__(self, ids):
+        self.ids = np.unique(np.asarray(list(ids)))
+        self._videos = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, ids, missing=None):
+        """
+        Codes of a sequence of ids, as an int64 array.
+
+        Args:
+            ids (iterable): Image ids.
+            missing (int): Code given to unknown ids; None raises a KeyError instead.
+        """
+        ids = np.asarray(list(ids) if not isinstance(ids, np.ndarray) else ids)
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        codes = np.searchsorted(self.ids, ids).astype(np.int64)
+        found = codes < len(self.ids)
+        found[found] = self.ids[codes[found]] == ids[found]
+        if not found.all():
+            if missing is None:
+                raise KeyError(ids[~found][0].item())
+            codes[~found] = missing
+        return codes
+
+    def code(self, image_id):
+        """Code of a single id."""
+        return int(self.encode([image_id])[0])
+
+    def decode(self, codes):
+        """Original ids of an array of codes, as a list of Python objects."""
+        return self.ids[np.asarray(codes, dtype=np.int64)].tolist()
+
+    def videos(self):
+        """
+        Video of every image.
+
+        Returns:
+            (np.ndarray, list): video code of each image code, and the video ids (sorted).
+        """
+        if self._videos is None:
+            names, codes = np.unique([video_id(i) for i in self.ids.tolist()], return_inverse=True)
+            self._videos = (codes.astype(np.int64).reshape(-1), names.tolist())
+        return self._videos
@@ -0,0 +1,249 @@
+"""
+Lesion-level detection latency of a detector on the test videos.
+
+For every lesion (the `unique_id` of the exported annotations) the annotated boxes
+are indexed once, sorted by frame number. At a score threshold s and an IoU
+threshold, a lesion box is detected when a prediction of score >= s overlaps it
+with IoU >= iou_thr (same IoU as roc_universal.py), and a frame raises a false
+alarm when it holds a prediction of score >= s that overlaps no annotated box.
+The metrics are:
+
+- time to first detection: frames (seconds with --fps) between the first
+  annotated frame of the lesion and its first detected frame;
+- per-lesion sensitivity: fraction of the annotated boxes of the lesion detected;
+- false alarm runs: runs of consecutive false alarm frames in each video.
+
+The IoU only enters through two score tables computed once: the best matching
+score of every annotated box and the best false alarm score of every frame. A
+threshold sweep then only ranks these scores against the sorted thresholds, and
+all the thresholds are computed together with integer prefix maxima, histograms
+and difference arrays (no loop over thresholds, lesions or frames).
+
+Usage:
+    python lesion_latency.py --gt <coco_gt.json> --pred <predictions.json> --output-dir <dir> \
+        [--iou-thr 0.2] [--score-thr 0.5] [--n-thr 100] [--fps 30]
+"""
+
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from id_index import IdIndex, frame_number
+from prediction_store import PredictionStore
+from roc_universal import compute_ious, frame_pairs
+
+
+class LesionIndex:
+    """
+    Frames, annotated boxes and lesions of a COCO GT file, as sorted integer arrays.
+
+    Images are referred to by their IdIndex code. The gt boxes are sorted by lesion,
+    then frame number: the boxes of lesion l are gt_*[lesion_start[l]:lesion_start[l + 1]].
+
+    Args:
+        data (dict): COCO GT json content (annotations with `unique_id`).
+    """
+
+    def __init__(self, data):
+        self.images = IdIndex(img["id"] for img in data["images"])
+        self.video, self.video_names = self.images.videos()
+        self.frame = np.array([frame_number(i) for i in self.images.ids.tolist()], dtype=np.int64)
+        # frames of each video in temporal order
+        self.frame_order = np.lexsort((self.frame, self.video))
+
+        anns = [ann for ann in data["annotations"] if "unique_id" in ann]
+        image = self.images.encode([ann["image_id"] for ann in anns])
+        names, lesion = np.unique(np.array([str(ann["unique_id"]) for ann in anns]), return_inverse=True)
+        lesion = lesion.reshape(-1)
+        boxes = np.array([ann["bbox"] for ann in anns], dtype=np.float64).reshape(-1, 4)
+        boxes[:, 2:] += boxes[:, :2]  # xywh -> xyxy
+
+        order = np.lexsort((self.frame[image], lesion))
+        self.gt_image, self.gt_lesion, self.gt_box = image[order], lesion[order], boxes[order]
+        self.lesion_names = names.tolist()
+        self.lesion_start = np.searchsorted(self.gt_lesion, np.arange(len(names) + 1))
+        self.lesion_video = self.video[self.gt_image[self.lesion_start[:-1]]]
+
+    @classmethod
+    def from_json(cls, coco_json_path):
+        with open(coco_json_path, "r") as f:
+            return cls(json.load(f))
+
+    def score_tables(self, preds, iou_thr=0.2):
+        """
+        Best score of the predictions detecting each gt box, and of the false alarms of each frame.
+
+        Args:
+            preds (PredictionStore | list): Predictions, as a store built on self.images or COCO
+                detection results (predictions on unknown images are dropped).
+            iou_thr (float): IoU threshold of a detection.
+
+        Returns:
+            (np.ndarray, np.ndarray): [G] score per gt box and [I] score per image, -inf if none.
+        """
+        if not isinstance(preds, PredictionStore):
+            preds = PredictionStore.from_results(preds, self.images)
+        image, score, boxes = preds.image, preds.score, preds.xyxy
+
+        pair_pred, pair_gt = frame_pairs(image, self.gt_image, len(self.images))
+        hit = compute_ious(boxes[pair_pred], self.gt_box[pair_gt]) >= iou_thr
+
+        gt_score = np.full(len(self.gt_image), -np.inf)
+        np.maximum.at(gt_score, pair_gt[hit], score[pair_pred[hit]])
+        false_alarm = np.bincount(pair_pred[hit], minlength=len(image)) == 0
+        frame_score = np.full(len(self.images), -np.inf)
+        np.maximum.at(frame_score, image[false_alarm], score[false_alarm])
+        return gt_score, frame_score
+
+
+def latency_metrics(index, gt_score, frame_score, thresholds, max_gap=1):
+    """
+    Latency, sensitivity and false alarm metrics at every score threshold.
+
+    Args:
+        index (LesionIndex): Indexed ground truth.
+        gt_score, frame_score (np.ndarray): Output of index.score_tables.
+        thresholds (np.ndarray): [S] score thresholds.
+        max_gap (int): Frames whose numbers differ by at most max_gap are consecutive in a run.
+
+    Returns:
+        dict: 'thresholds' [S] (sorted), and
+            'first_detection' [L x S] frames until the first detection of each lesion (nan if missed),
+            'detected_boxes' [L x S] and 'lesion_boxes' [L] detected / annotated boxes of each lesion,
+            'false_alarm_frames' and 'false_alarm_runs' [V x S] per video, 'video_frames' [V].
+    """
+    thresholds = np.sort(np.asarray(thresholds, dtype=np.float64))
+    S, L, V = len(thresholds), len(index.lesion_names), len(index.video_names)
+    # a score is above thresholds[j] for every j < its rank
+    gt_rank = np.searchsorted(thresholds, gt_score, "right")
+    frame_rank = np.searchsorted(thresholds, frame_score, "right")
+
+    # first detection: prefix maximum of the ranks within each lesion (the lesion offsets
+    # keep the keys of a lesion above all the previous ones), then one searchsorted per
+    # (lesion, threshold) for the first box of rank > j
+    key = index.gt_lesion * (S + 1) + gt_rank
+    first = np.searchsorted(np.maximum.accumulate(key), (np.arange(L) * (S + 1))[:, None] + np.arange(S), "right")
+    missed = first >= index.lesion_start[1:, None]
+    frames = np.r_[index.frame[index.gt_image], 0]  # sentinel for the missed lesions
+    first_detection = np.where(missed, np.nan, frames[first] - frames[index.lesion_start[:-1], None])
+
+    # detected boxes: per lesion histogram of the ranks, counted from the top
+    hist = np.bincount(key, minlength=L * (S + 1)).reshape(L, S + 1)
+    detected_boxes = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    # false alarms: frame f starts a run for the thresholds j in [rank of the previous
+    # consecutive frame, rank of f), counted with a difference array over j
+    order = index.frame_order
+    video, rank = index.video[order], frame_rank[order]
+    prev = np.r_[0, rank[:-1]]
+    linked = np.r_[False, (video[1:] == video[:-1]) & (np.diff(index.frame[order]) <= max_gap)]
+    prev = np.where(linked, prev, 0)
+    starts = np.zeros((V, S + 1), dtype=np.int64)
+    np.add.at(starts, (video, np.minimum(prev, rank)), 1)
+    np.add.at(starts, (video, rank), -1)
+    hist = np.zeros((V, S + 1), dtype=np.int64)
+    np.add.at(hist, (video, rank), 1)
+
+    return {
+        "thresholds": thresholds,
+        "first_detection": first_detection,
+        "detected_boxes": detected_boxes,
+        "lesion_boxes": np.diff(index.lesion_start),
+        "false_alarm_frames": np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, 1:],
+        "false_alarm_runs": np.cumsum(starts, axis=1)[:, :S],
+        "video_frames": np.bincount(index.video, minlength=V),
+    }
+
+
+def sweep_table(metrics, fps=None):
+    """One row per threshold: lesion sensitivity, median delay, box sensitivity and false alarms."""
+    delay = metrics["first_detection"]
+    scale = 1.0 / fps if fps else 1.0
+    unit = "s" if fps else "frames"
+    rows = []
+    for j, thr in enumerate(metrics["thresholds"]):
+        found = ~np.isnan(delay[:, j])
+        rows.append({
+            "score_thr": float(thr),
+            "lesions_detected": float(found.mean()) if len(found) else -1.0,
+            f"median_delay [{unit}]": float(np.median(delay[found, j]) * scale) if found.any() else -1.0,
+            "box_sensitivity": float(metrics["detected_boxes"][:, j].sum() / max(metrics["lesion_boxes"].sum(), 1)),
+            "false_alarm_runs": int(metrics["false_alarm_runs"][:, j].sum()),
+            "false_alarm_frames": int(metrics["false_alarm_frames"][:, j].sum()),
+        })
+    return rows
+
+
+def lesion_table(index, metrics, j, fps=None):
+    """One row per lesion at the threshold of index j."""
+    scale = 1.0 / fps if fps else 1.0
+    unit = "s" if fps else "frames"
+    rows = []
+    for l, name in enumerate(index.lesion_names):
+        delay = metrics["first_detection"][l, j]
+        rows.append({
+            "video": index.video_names[index.lesion_video[l]],
+            "lesion": name,
+            "boxes": int(metrics["lesion_boxes"][l]),
+            "detected": int(metrics["detected_boxes"][l, j]),
+            "sensitivity": float(metrics["detected_boxes"][l, j] / metrics["lesion_boxes"][l]),
+            f"first_detection [{unit}]": -1.0 if np.isnan(delay) else float(delay * scale),
+        })
+    return rows
+
+
+def video_table(index, metrics, j, fps=None):
+    """One row per video at the threshold of index j (false alarm runs per minute with fps)."""
+    rows = []
+    for v, name in enumerate(index.video_names):
+        row = {
+            "video": name,
+            "frames": int(metrics["video_frames"][v]),
+            "lesions": int((index.lesion_video == v).sum()),
+            "false_alarm_frames": int(metrics["false_alarm_frames"][v, j]),
+            "false_alarm_runs": int(metrics["false_alarm_runs"][v, j]),
+        }
+        if fps:
+            row["runs_per_min"] = float(row["false_alarm_runs"] / (row["frames"] / fps / 60))
+        rows.append(row)
+    return rows
+
+
+def write_csv(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print("Saved:", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gt", type=str, required=True, help="COCO GT json file (with unique_id annotations)")
+    parser.add_argument("--pred", type=str, required=True, help="Predictions json (COCO detection format)")
+    parser.add_argument("--output-dir", type=str, required=True, help="Directory for the CSV tables")
+    parser.add_argument("--iou-thr", type=float, default=0.2, help="IoU threshold of a detection")
+    parser.add_argument("--score-thr", type=float, default=0.5, help="Score threshold of the per lesion / video tables")
+    parser.add_argument("--n-thr", type=int, default=100, help="Number of score thresholds of the sweep")
+    parser.add_argument("--fps", type=float, default=None, help="Frame rate, to report delays in seconds")
+    parser.add_argument("--max-gap", type=int, default=1, help="Max frame number gap inside a false alarm run")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    index = LesionIndex.from_json(args.gt)
+    gt_score, frame_score = index.score_tables(PredictionStore.from_json(args.pred, index.images), args.iou_thr)
+
+    thresholds = np.unique(np.r_[np.linspace(0, 1, args.n_thr, endpoint=False), args.score_thr])
+    metrics = latency_metrics(index, gt_score, frame_score, thresholds, args.max_gap)
+    j = int(np.flatnonzero(metrics["thresholds"] == args.score_thr)[0])
+
+    write_csv(sweep_table(metrics, args.fps), os.path.join(args.output_dir, "latency_sweep.csv"))
+    write_csv(lesion_table(index, metrics, j, args.fps), os.path.join(args.output_dir, "latency_per_lesion.csv"))
+    write_csv(video_table(index, metrics, j, args.fps), os.path.join(args.output_dir, "latency_per_video.csv"))
+    row = sweep_table(metrics, args.fps)[j]
+    print(f"\nscore >= {args.score_thr}, IoU >= {args.iou_thr}:")
+    for k, v in row.items():
+        print(f"  {k:<24}{v}")
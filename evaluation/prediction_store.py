@@ -0,0 +1,252 @@
+"""
+Array-backed container of detection results.
+
+Detections in COCO results format (one dict per box) cost a few hundred bytes of
+Python objects each. PredictionStore keeps them as parallel NumPy arrays (image
+code, score, box, category) sorted by image, with CSR offsets: the detections of
+the image of code c are rows offsets[c]:offsets[c + 1].
+
+Image codes are the ones of an IdIndex of the ground truth images (see id_index.py).
+The store is consumed directly by:
+
+- roc_universal.py: load_predictions returns a store and build_frame_scores /
+  frame_scores use its arrays;
+- lesion_latency.py: LesionIndex.score_tables accepts a store;
+- cocoeval.py: the store implements the part of the COCO API that COCOeval uses
+  for detections (getAnnIds / loadAnns), so it can be passed as cocoDt instead of
+  cocoGt.loadRes(...). Annotation ids, areas and iscrowd follow COCO.loadRes
+  (ids 1..N in file order, area = w * h, iscrowd = 0); only bbox results are supported.
+
+Results files saved at a very low confidence threshold can be several GB. from_json
+streams them: the top-level JSON list is read a chunk at a time, the complete
+detections of each chunk are decoded together and appended to the arrays, so the
+whole text and its Python objects never live in memory at once. A score floor and
+a top-k per image can be applied while reading; with top_k >= maxDets[-1] COCOeval
+gives the same results as without pruning (it keeps the first maxDets[-1]
+detections of an image by score, ties in file order, like the pruning).
+"""
+
+import json
+
+import numpy as np
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(f, chunk_size=1 << 24):
+    """
+    Elements of the top-level JSON list of a text file, decoded a chunk at a time.
+
+    Args:
+        f (file): File opened in text mode.
+        chunk_size (int): Number of characters read at a time.
+
+    Yields:
+        list: the elements completed by each chunk (possibly empty).
+    """
+    buf, started = "", False
+    while True:
+        data = f.read(chunk_size)
+        buf += data
+        if not started:
+            buf = buf.lstrip()
+            if not buf:
+                if not data:
+                    raise ValueError("Empty JSON file")
+                continue
+            if buf[0] != "[":
+                raise ValueError("Expected a JSON list of detections")
+            buf, started = buf[1:], True
+        # complete elements: decode everything up to the last "}" in one call, falling
+        # back to one element at a time when that cut is inside an element
+        end = buf.rfind("}") + 1
+        items = []
+        if end:
+            try:
+                items = json.loads("[" + buf[:end].strip().lstrip(",") + "]")
+                buf = buf[end:]
+            except ValueError:
+                pos = 0
+                while True:
+                    while pos < len(buf) and buf[pos] in " \t\r\n,":
+                        pos += 1
+                    try:
+                        item, pos = _decoder.raw_decode(buf, pos)
+                    except ValueError:
+                        break
+                    items.append(item)
+                buf = buf[pos:]
+        yield items
+        if not data:
+            if buf.strip().lstrip(",").strip() != "]":
+                raise ValueError("Truncated JSON list of detections")
+            return
+
+
+def top_k_mask(image, category, score, order_key, k):
+    """
+    Mask of the k highest scores of every (image, category), ties broken by order_key (file order).
+    """
+    order = np.lexsort((order_key, -score, category, image))
+    group = np.r_[True, (np.diff(image[order]) != 0) | (np.diff(category[order]) != 0)]
+    start = np.maximum.accumulate(np.where(group, np.arange(len(order)), 0))
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[np.arange(len(order)) - start < k]] = True
+    return mask
+
+
+class PredictionStore:
+    """
+    Detections sorted by image code, as parallel arrays.
+
+    Args:
+        index (IdIndex): Image ids of the ground truth (defines the image codes).
+        image (np.ndarray): [N] image code of each detection.
+        score (np.ndarray): [N] confidence.
+        xywh (np.ndarray): [N x 4] boxes in COCO format.
+        category (np.ndarray): [N] category id.
+        ids (np.ndarray): [N] annotation ids (default: 1..N in the given order).
+    """
+
+    def __init__(self, index, image, score, xywh, category, ids=None):
+        image = np.asarray(image, dtype=np.int64)
+        if ids is None:
+            ids = np.arange(1, len(image) + 1)
+        # stable sort: the detections of an image keep their file order (as COCO.loadRes)
+        order = np.argsort(image, kind="stable")
+        self.index = index
+        self.image = image[order]
+        self.score = np.asarray(score, dtype=np.float64)[order]
+        self.xywh = np.asarray(xywh, dtype=np.float64).reshape(-1, 4)[order]
+        self.category = np.asarray(category, dtype=np.int64)[order]
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.offsets = np.searchsorted(self.image, np.arange(len(index) + 1))
+        self._xyxy = None
+        self._rowOfId = None
+
+    @classmethod
+    def from_results(cls, preds, index, drop_unknown=True):
+        """
+        Build a store from COCO detection results.
+
+        Args:
+            preds (list): Result dicts with image_id, bbox, score and category_id.
+            index (IdIndex): Ground truth image ids.
+            drop_unknown (bool): Drop the detections of images not in index (else raise a KeyError).
+        """
+        n = len(preds)
+        image = index.encode([p["image_id"] for p in preds], missing=-1 if drop_unknown else None)
+        score = np.fromiter((p["score"] for p in preds), dtype=np.float64, count=n)
+        xywh = np.fromiter((v for p in preds for v in p["bbox"]), dtype=np.float64, count=4 * n)
+        category = np.fromiter((p.get("category_id", 0) for p in preds), dtype=np.int64, count=n)
+        keep = image >= 0
+        ids = np.arange(1, n + 1)
+        return cls(index, image[keep], score[keep], xywh.reshape(-1, 4)[keep], category[keep], ids[keep])
+
+    @classmethod
+    def from_json(cls, pred_json_path, index, drop_unknown=True, score_floor=None, top_k=None,
+                  chunk_size=1 << 24):
+        """
+        Stream a COCO results json file into a store.
+
+        Args:
+            pred_json_path (str): COCO results json (a list of detections).
+            index (IdIndex): Ground truth image ids.
+            drop_unknown (bool): Drop the detections of images not in index (else raise a KeyError).
+            score_floor (float): Drop the detections with score < score_floor.
+            top_k (int): Keep the top_k highest scores of every image (and category).
+            chunk_size (int): Characters read at a time.
+        """
+        blocks, pending, n = [], 0, 0
+        with open(pred_json_path, "r") as f:
+            for preds in iter_json_array(f, chunk_size):
+                if not preds:
+                    continue
+                block = cls.from_results(preds, index, drop_unknown)
+                block.ids += n  # ids stay the positions in the whole file
+                n += len(preds)
+                keep = block.score >= score_floor if score_floor is not None else slice(None)
+                blocks.append((block.image[keep], block.score[keep], block.xywh[keep], block.category[keep],
+                               block.ids[keep]))
+                pending += len(blocks[-1][0])
+                # bound the memory with top-k: prune once the pending rows reach the kept ones
+                if top_k is not None and pending > max(1 << 20, 2 * len(blocks[0][0])):
+                    blocks, pending = [cls._prune(blocks, top_k)], 0
+
+        if top_k is not None and blocks:
+            blocks = [cls._prune(blocks, top_k)]
+        if not blocks:
+            return cls(index, [], [], np.zeros((0, 4)), [], [])
+        image, score, xywh, category, ids = (np.concatenate(c) for c in zip(*blocks))
+        return cls(index, image, score, xywh, category, ids)
+
+    @staticmethod
+    def _prune(blocks, top_k):
+        image, score, xywh, category, ids = (np.concatenate(c) for c in zip(*blocks))
+        keep = top_k_mask(image, category, score, ids, top_k)
+        return image[keep], score[keep], xywh[keep], category[keep], ids[keep]
+
+    def __len__(self):
+        return len(self.image)
+
+    @property
+    def n_images(self):
+        return len(self.index)
+
+    @property
+    def xyxy(self):
+        """[N x 4] boxes as (x1, y1, x1 + w, y1 + h)."""
+        if self._xyxy is None:
+            self._xyxy = np.concatenate([self.xywh[:, :2], self.xywh[:, :2] + self.xywh[:, 2:]], axis=1)
+        return self._xyxy
+
+    def image_slice(self, code):
+        """Rows of the detections of the image of the given code."""
+        return slice(self.offsets[code], self.offsets[code + 1])
+
+    def counts(self):
+        """[I] number of detections of every image."""
+        return np.diff(self.offsets)
+
+    # COCO API subset used by COCOeval for the detections
+    def getImgIds(self):
+        return self.index.decode(np.flatnonzero(self.counts()))
+
+    def getAnnIds(self, imgIds=[], catIds=[], areaRng=[], iscrowd=None):
+        '''
+        Ids of the detections of the given images / categories / area range, grouped by image
+        in the order of imgIds (as COCO.getAnnIds)
+        '''
+        imgIds = imgIds if isinstance(imgIds, (list, tuple, np.ndarray)) else [imgIds]
+        catIds = catIds if isinstance(catIds, (list, tuple, np.ndarray)) else [catIds]
+        if len(imgIds) == 0:
+            rows = np.arange(len(self))
+        else:
+            codes = self.index.encode(imgIds, missing=-1)
+            codes = codes[codes >= 0]
+            starts, ends = self.offsets[codes], self.offsets[codes + 1]
+            n = ends - starts
+            rows = np.repeat(starts - (np.cumsum(n) - n), n) + np.arange(n.sum())
+        if len(catIds) > 0:
+            rows = rows[np.isin(self.category[rows], catIds)]
+        if len(areaRng) > 0:
+            area = self.xywh[rows, 2] * self.xywh[rows, 3]
+            rows = rows[(area > areaRng[0]) & (area < areaRng[1])]
+        if iscrowd is not None and iscrowd:
+            rows = rows[:0]
+        return self.ids[rows].tolist()
+
+    def loadAnns(self, ids=[]):
+        '''
+        Detections of the given ids as COCO.loadRes annotation dicts (created on demand)
+        '''
+        ids = ids if isinstance(ids, (list, tuple, np.ndarray)) else [ids]
+        if self._rowOfId is None:
+            self._rowOfId = np.argsort(self.ids)
+        rows = self._rowOfId[np.searchsorted(self.ids, ids, sorter=self._rowOfId)]
+        imgIds = self.index.decode(self.image[rows])
+        xywh = self.xywh[rows].tolist()
+        return [{'image_id': imgId, 'category_id': cat, 'bbox': bb, 'score': score,
+                 'area': bb[2] * bb[3], 'id': annId, 'iscrowd': 0}
+                for imgId, cat, bb, score, annId in zip(imgIds, self.category[rows].tolist(), xywh,
+                                                         self.score[rows].tolist(), self.ids[rows].tolist())]
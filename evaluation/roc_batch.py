@@ -0,0 +1,182 @@
+"""
+Frame-level ROC of many models / checkpoints in one run.
+
+roc_universal.py scores one (GT, predictions) pair per invocation. This script
+takes a manifest of entries, loads and flattens each distinct GT file once in the
+main process, and scores the predictions files in worker processes forked from
+it (the GT arrays are shared, not copied). Every entry goes through the result
+cache of roc_universal.py (score_cache.py), so unchanged entries are not scored
+again. The output is one summary table (CSV), one JSON file with the curves and
+operating points, and, with --plot, one comparison figure; matplotlib is only
+imported in that case.
+
+Manifest: one "<name> <coco_gt.json> <predictions.json>" per line ('#' starts a comment).
+
+Usage:
+    python roc_batch.py --manifest runs.txt --output-dir <dir> [--workers 4] [--iou-thr 0.2] [--plot]
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from roc_universal import load_ground_truth, load_predictions, gt_arrays, frame_scores, roc_family
+from score_cache import cached_frame_scores, cached_hash, load_scores
+
+# gt path -> (IdIndex, gt frame codes, gt xyxy boxes), inherited by the forked workers
+_gts = {}
+
+
+def read_manifest(path):
+    """(name, gt path, predictions path) entries of a manifest file."""
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                name, gt_path, pred_path = line.split()
+                entries.append((name, gt_path, pred_path))
+    names = [e[0] for e in entries]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicated names in {path}: {names}")
+    return entries
+
+
+def load_gts(gt_paths):
+    """Load and flatten every distinct GT file once (into the module table shared with the workers)."""
+    for gt_path in sorted(set(gt_paths)):
+        if gt_path not in _gts:
+            gt_boxes, index = load_ground_truth(gt_path)
+            _gts[gt_path] = (index,) + gt_arrays(gt_boxes)
+
+
+def score_entry(job):
+    """
+    Frame scores (cached) and ROC family of one manifest entry.
+
+    Args:
+        job (tuple): (name, gt path, predictions path, params dict, cache folder).
+
+    Returns:
+        dict: name, roc_family results, frames, positives, cache hit and time.
+    """
+    name, gt_path, pred_path, params, cache_dir = job
+    tic = time.time()
+    index, gt_frame, gt_xyxy = _gts[gt_path]
+    iou_thr = params["iou_thr"]
+
+    def compute():
+        store = load_predictions(pred_path, index, score_floor=params["score_floor"], top_k=params["top_k"])
+        # same array layout as roc_universal.py, so both tools share the cache entries
+        y_true, y_score = frame_scores(len(index), gt_frame, gt_xyxy, store.image, store.score, store.xyxy,
+                                       iou_thr if len(iou_thr) > 1 else iou_thr[0])
+        return y_true, y_score, index.ids
+
+    folder, hit = cached_frame_scores(gt_path, pred_path, params, compute, cache_dir)
+    scores = load_scores(folder)
+    y_true = np.asarray(scores["y_true"])
+    y_score = np.asarray(scores["y_score"]).reshape(len(y_true), -1)
+    return {"name": name, "gt": gt_path, "pred": pred_path, "frames": len(y_true),
+            "positives": int(y_true.sum()), "cached": hit, "time": time.time() - tic,
+            "results": roc_family(y_true, y_score, iou_thr)}
+
+
+def run_batch(entries, params, cache_dir, workers=1):
+    """Score all the entries, in a fork pool when workers > 1; returns score_entry outputs in manifest order."""
+    os.makedirs(cache_dir, exist_ok=True)
+    load_gts([gt_path for _, gt_path, _ in entries])
+    # hash the shared GT files once here rather than in every worker
+    for gt_path in _gts:
+        cached_hash(gt_path, cache_dir)
+    jobs = [(name, gt_path, pred_path, params, cache_dir) for name, gt_path, pred_path in entries]
+    if workers > 1 and len(jobs) > 1:
+        ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else None)
+        with ctx.Pool(min(workers, len(jobs))) as pool:
+            return pool.map(score_entry, jobs, chunksize=1)
+    return [score_entry(job) for job in jobs]
+
+
+def summary_rows(outputs):
+    """One row per (entry, IoU threshold): AUC and the main operating points."""
+    rows = []
+    for out in outputs:
+        for r in out["results"]:
+            ops = {p["rule"]: p for p in r["operating_points"]}
+            rows.append({
+                "name": out["name"],
+                "iou_thr": r["iou_thr"],
+                "frames": out["frames"],
+                "positives": out["positives"],
+                "auc": r["auc"],
+                "tpr@fpr<=0.05": ops["fpr<=0.05"]["tpr"] if "fpr<=0.05" in ops else -1.0,
+                "fpr@tpr>=0.9": ops["tpr>=0.9"]["fpr"] if "tpr>=0.9" in ops else -1.0,
+                "cached": out["cached"],
+                "time [s]": round(out["time"], 2),
+            })
+    return rows
+
+
+def plot_comparison(outputs, path):
+    """One figure with the ROC curve of every (entry, IoU threshold)."""
+    import matplotlib.pyplot as plt
+
+    multi = len(outputs[0]["results"]) > 1
+    plt.figure(figsize=(8, 6))
+    for out in outputs:
+        for r in out["results"]:
+            label = f"{out['name']} (IoU ≥ {r['iou_thr']:g})" if multi else out["name"]
+            plt.plot(r["fpr"], r["tpr"], label=f"{label}, AUC={r['auc']:.3f}")
+    plt.plot([0, 1], [0, 1], "k--", linewidth=0.8)
+    plt.xlabel("False Positive Rate")
+    plt.ylabel("True Positive Rate")
+    plt.title("Frame-level ROC comparison")
+    plt.grid(True)
+    plt.legend(fontsize="small")
+    plt.savefig(path, dpi=300)
+    plt.close()
+    print("ROC saved to:", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", type=str, required=True, help="'<name> <coco_gt.json> <predictions.json>' lines")
+    parser.add_argument("--output-dir", type=str, required=True, help="Directory for the summary, curves and figure")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--iou-thr", type=float, nargs="+", default=[0.2], help="IoU threshold(s)")
+    parser.add_argument("--score-floor", type=float, default=None, help="Ignore predictions below this score")
+    parser.add_argument("--top-k", type=int, default=None, help="Keep the top-k predictions of each frame")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Result cache folder (default: <output-dir>/.cache)")
+    parser.add_argument("--plot", action="store_true", help="Save the comparison figure (imports matplotlib)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    entries = read_manifest(args.manifest)
+    params = {"iou_thr": args.iou_thr, "score_floor": args.score_floor, "top_k": args.top_k}
+    tic = time.time()
+    outputs = run_batch(entries, params, args.cache_dir or os.path.join(args.output_dir, ".cache"), args.workers)
+
+    rows = summary_rows(outputs)
+    csv_path = os.path.join(args.output_dir, "roc_summary.csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    json_path = os.path.join(args.output_dir, "roc_batch.json")
+    with open(json_path, "w") as f:
+        json.dump(outputs, f)
+
+    width = max(12, max(len(r["name"]) for r in rows) + 2)
+    print("\n" + f"{'name':<{width}}{'IoU':>6}{'AUC':>8}{'TPR@5%FPR':>11}{'FPR@90%TPR':>12}{'cached':>8}")
+    for r in rows:
+        print(f"{r['name']:<{width}}{r['iou_thr']:>6g}{r['auc']:>8.4f}{r['tpr@fpr<=0.05']:>11.3f}"
+              f"{r['fpr@tpr>=0.9']:>12.3f}{str(r['cached']):>8}")
+    print("Saved:", csv_path)
+    print("Saved:", json_path)
+    if args.plot:
+        plot_comparison(outputs, os.path.join(args.output_dir, "ROC_comparison.png"))
+    print(f"{len(entries)} entries in {time.time() - tic:.1f}s")
@@ -1,10 +1,13 @@
 import json
 import numpy as np
 from sklearn.metrics import roc_curve, auc, roc_auc_score
-from tqdm import tqdm
-import pickle
 import os
 import argparse
+from itertools import chain
+
+from id_index import IdIndex
+from prediction_store import PredictionStore
+from score_cache import cached_frame_scores, export_scores, load_scores, save_scores
 
 # Compute IoU between two xyxy boxes
 def compute_iou(box1, box2):
@@ -23,122 +26,245 @@ def compute_iou(box1, box2):
     union = area1 + area2 - inter
     return inter / (union + 1e-6)
 
+# Vectorized compute_iou: IoU of boxes1[..., :] with boxes2[..., :] (xyxy, broadcast)
+def compute_ious(boxes1, boxes2):
+    boxes1 = np.asarray(boxes1, dtype=np.float64)
+    boxes2 = np.asarray(boxes2, dtype=np.float64)
+    xA = np.maximum(boxes1[..., 0], boxes2[..., 0])
+    yA = np.maximum(boxes1[..., 1], boxes2[..., 1])
+    xB = np.minimum(boxes1[..., 2], boxes2[..., 2])
+    yB = np.minimum(boxes1[..., 3], boxes2[..., 3])
+
+    inter = np.maximum(0, xB - xA) * np.maximum(0, yB - yA)
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+
+    union = area1 + area2 - inter
+    return np.where(inter > 0, inter / (union + 1e-6), 0.0)
+
 # Load GT COCO
 def load_ground_truth(coco_json_path):
     with open(coco_json_path, "r") as f:
         data = json.load(f)
 
-    # images = list of dicts
-    # id values are strings in your dataset → ok
-    images = data["images"]
+    # id values are strings in your dataset ("001-010_18185"): intern them once,
+    # frames are then referred to by their integer code (position in index.ids)
+    index = IdIndex(img["id"] for img in data["images"])
 
-    # map image_id --> list of GT boxes
-    gt_dict = {img["id"]: [] for img in images}
+    # image code --> list of GT boxes
+    gt_boxes = [[] for _ in range(len(index))]
 
-    for ann in data["annotations"]:
+    anns = data["annotations"]
+    for code, ann in zip(index.encode([ann["image_id"] for ann in anns]), anns):
         x, y, w, h = ann["bbox"]
-        img_id = ann["image_id"]
 
         # convert to xyxy
         box = [x, y, x + w, y + h]
-        gt_dict[img_id].append(box)
-
-    return gt_dict, images
-
-# Load predictions (COCO detection format)
-def load_predictions(pred_json_path):
-    with open(pred_json_path, "r") as f:
-        preds = json.load(f)
-
-    pred_dict = {}
-
-    for p in preds:
-        img_id = p["image_id"]
-        x, y, w, h = p["bbox"]
-        score = p["score"]
-
-        box = [x, y, x + w, y + h]  # convert to xyxy
-
-        if img_id not in pred_dict:
-            pred_dict[img_id] = []
-        pred_dict[img_id].append([score, box])
-
-    return pred_dict
-
-# Build frame-level labels and scores
-def build_frame_scores(gt_dict, pred_dict, img_list, iou_thr=0.2):
-    true_labels = []
-    pred_scores = []
-
-    for img in tqdm(img_list, desc="Processing frames"):
-        img_id = img["id"]
-        gt_boxes = gt_dict[img_id]
-        preds = pred_dict.get(img_id, [])
-
-        # Does this frame contain a polyp?
-        frame_has_polyp = 1 if len(gt_boxes) > 0 else 0
-        true_labels.append(frame_has_polyp)
-
-        if len(preds) == 0:
-            pred_scores.append(0)
-            continue
-
-        best_score = 0
-
-        if frame_has_polyp == 0:
-            # No GT: take the max confidence
-            best_score = max([p[0] for p in preds])
-        else:
-            # GT exists: look for detections with IoU ≥ threshold
-            for score, box_pred in preds:
-                for box_gt in gt_boxes:
-                    if compute_iou(box_pred, box_gt) >= iou_thr:
-                        best_score = max(best_score, score)
-                        break
-
-        pred_scores.append(best_score)
-
-    return np.array(true_labels), np.array(pred_scores)
+        gt_boxes[code].append(box)
+
+    return gt_boxes, index
+
+# Load predictions (COCO detection format) into a PredictionStore: arrays sorted by
+# image code; predictions on images not in the GT are dropped. The file is streamed,
+# optionally keeping only scores >= score_floor and the top_k scores of each image
+def load_predictions(pred_json_path, index, score_floor=None, top_k=None):
+    return PredictionStore.from_json(pred_json_path, index, score_floor=score_floor, top_k=top_k)
+
+# All (prediction, gt) index pairs on the same frame, from the frame code of each box
+def frame_pairs(pred_frame, gt_frame, n_frames):
+    gt_by_frame = np.argsort(gt_frame, kind="stable")
+    n_gt = np.bincount(gt_frame, minlength=n_frames)
+    gt_first = np.cumsum(n_gt) - n_gt
+
+    n_pairs = n_gt[pred_frame]
+    pair_pred = np.repeat(np.arange(len(pred_frame)), n_pairs)
+    pair_start = np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+    pair_gt = gt_by_frame[np.repeat(gt_first[pred_frame], n_pairs) + np.arange(n_pairs.sum()) - pair_start]
+    return pair_pred, pair_gt
+
+# Frame-level labels and scores from flat box arrays: gt_frame / pred_frame are the
+# frame codes (0..n_frames-1) of each GT box / prediction, boxes are [N x 4] xyxy.
+# iou_thr can be a list: the IoUs are computed once and the scores of all the
+# thresholds are returned as a [n_frames x len(iou_thr)] array
+def frame_scores(n_frames, gt_frame, gt_xyxy, pred_frame, scores, pred_xyxy, iou_thr=0.2):
+    thrs = np.atleast_1d(np.asarray(iou_thr, dtype=np.float64))
+    thr_order = np.argsort(thrs)
+    K = len(thrs)
+
+    # Does this frame contain a polyp?
+    true_labels = (np.bincount(gt_frame, minlength=n_frames) > 0).astype(np.int64)
+
+    # GT exists: a detection counts if its IoU with any GT box is >= threshold, i.e.
+    # for the (sorted) thresholds below its best IoU
+    pair_pred, pair_gt = frame_pairs(pred_frame, gt_frame, n_frames)
+    best_iou = np.full(len(scores), -np.inf)
+    np.maximum.at(best_iou, pair_pred, compute_ious(pred_xyxy[pair_pred], gt_xyxy[pair_gt]))
+    n_thr_hit = np.searchsorted(thrs[thr_order], best_iou, "right")
+    # No GT: take the max confidence (every prediction counts at every threshold)
+    n_thr_hit[true_labels[pred_frame] == 0] = K
+
+    # best score of each frame among the predictions counted at >= j thresholds, then
+    # suffix max: column j is the best score of the predictions counted at threshold j
+    best = np.full((n_frames, K + 1), -np.inf)
+    np.maximum.at(best, (pred_frame, n_thr_hit), scores)
+    best = np.maximum.accumulate(best[:, :0:-1], axis=1)[:, ::-1]
+
+    # frames without predictions (or without a matching one when there is GT) score 0
+    pred_scores = np.where(best == -np.inf, 0, best)
+    pos = true_labels == 1
+    pred_scores[pos] = np.maximum(pred_scores[pos], 0)
+    pred_scores = pred_scores[:, np.argsort(thr_order)]
+
+    return true_labels, pred_scores if np.ndim(iou_thr) else pred_scores[:, 0]
+
+# Concatenate the GT boxes of all the frames: (frame code of each box, [N x 4] xyxy)
+# (np.fromiter over flat iterators, much faster than np.array on nested lists)
+def gt_arrays(gt_boxes_list):
+    n_gt = np.fromiter(map(len, gt_boxes_list), dtype=np.int64, count=len(gt_boxes_list))
+    gt_xyxy = np.fromiter(chain.from_iterable(chain.from_iterable(gt_boxes_list)), dtype=np.float64,
+                          count=4 * n_gt.sum()).reshape(-1, 4)
+    return np.repeat(np.arange(len(gt_boxes_list)), n_gt), gt_xyxy
+
+# Build frame-level labels and scores, one entry per image code. pred_boxes is a
+# PredictionStore (load_predictions) or a list of [score, xyxy box] lists per code
+def build_frame_scores(gt_boxes_list, pred_boxes, iou_thr=0.2):
+    n_frames = len(gt_boxes_list)
+    gt_frame, gt_xyxy = gt_arrays(gt_boxes_list)
+
+    if isinstance(pred_boxes, PredictionStore):
+        return frame_scores(n_frames, gt_frame, gt_xyxy, pred_boxes.image, pred_boxes.score, pred_boxes.xyxy,
+                            iou_thr)
+
+    n_pred = np.fromiter(map(len, pred_boxes), dtype=np.int64, count=n_frames)
+    preds = list(chain.from_iterable(pred_boxes))
+    scores = np.fromiter((p[0] for p in preds), dtype=np.float64, count=len(preds))
+    pred_xyxy = np.fromiter(chain.from_iterable(p[1] for p in preds), dtype=np.float64,
+                            count=4 * len(preds)).reshape(-1, 4)
+
+    return frame_scores(n_frames, gt_frame, gt_xyxy, np.repeat(np.arange(n_frames), n_pred), scores, pred_xyxy, iou_thr)
+
+# Operating points of a ROC curve: best TPR with FPR <= each max_fpr, lowest FPR with
+# TPR >= each min_tpr, and the point maximizing TPR - FPR (Youden)
+def operating_points(fpr, tpr, thresholds, max_fpr=(0.01, 0.05, 0.1), min_tpr=(0.9, 0.95)):
+    def point(rule, i):
+        thr = float(thresholds[i])
+        return {"rule": rule, "score_thr": thr if np.isfinite(thr) else None,
+                "fpr": float(fpr[i]), "tpr": float(tpr[i])}
+
+    # with a single class in y_true, roc_curve returns nan fpr (no negatives) or tpr (no positives):
+    # the rules that no point satisfies are left out
+    points = []
+    for target in max_fpr:
+        # fpr and tpr are non decreasing: the last point under the FPR bound has the best TPR
+        under = np.flatnonzero(fpr <= target)
+        if len(under):
+            points.append(point(f"fpr<={target:g}", under[-1]))
+    for target in min_tpr:
+        reached = np.flatnonzero(tpr >= target)
+        if len(reached):
+            points.append(point(f"tpr>={target:g}", reached[0]))
+    youden = tpr - fpr
+    if np.isfinite(youden).any():
+        points.append(point("youden", int(np.nanargmax(youden))))
+    return points
+
+# ROC curve, AUC and operating points for each IoU threshold (columns of y_scores)
+def roc_family(y_true, y_scores, iou_thrs):
+    results = []
+    for k, iou_thr in enumerate(iou_thrs):
+        fpr, tpr, thresholds = roc_curve(y_true, y_scores[:, k])
+        results.append({"iou_thr": float(iou_thr), "auc": float(auc(fpr, tpr)),
+                        "operating_points": operating_points(fpr, tpr, thresholds),
+                        "fpr": fpr.tolist(), "tpr": tpr.tolist(),
+                        "score_thr": [float(t) if np.isfinite(t) else None for t in thresholds]})
+    return results
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("coco_gt", type=str, help="COCO GT json file")
     parser.add_argument("pred_json", type=str, help="Predictions json")
-    parser.add_argument("output_dir", type=str, help="Directory to save ROC + PKL")
+    parser.add_argument("output_dir", type=str, help="Directory to save ROC + labels / scores")
+    parser.add_argument("--score-floor", type=float, default=None, help="Ignore predictions below this score")
+    parser.add_argument("--top-k", type=int, default=None, help="Keep the top-k predictions of each frame")
+    parser.add_argument("--iou-thr", type=float, nargs="+", default=[0.2],
+                        help="IoU threshold(s); several values give one ROC per threshold from one IoU computation")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Result cache folder (default: <output_dir>/.cache)")
+    parser.add_argument("--no-cache", action="store_true", help="Always recompute the frame scores")
     args = parser.parse_args()
 
     os.makedirs(args.output_dir, exist_ok=True)
-
-    print("Loading ground truth...")
-    gt_dict, img_list = load_ground_truth(args.coco_gt)
-
-    print("Loading predictions...")
-    pred_dict = load_predictions(args.pred_json)
-
-    print("Building frame-level labels and scores...")
-    y_true, y_score = build_frame_scores(gt_dict, pred_dict, img_list, iou_thr=0.2)
-
-    # save pkl
-    pkl_path = os.path.join(args.output_dir, "labels_scores.pkl")
-    with open(pkl_path, "wb") as f:
-        pickle.dump((y_true, y_score), f)
-    print("Saved:", pkl_path)
-
-    # compute ROC
-    fpr, tpr, _ = roc_curve(y_true, y_score)
-    auc_value = auc(fpr, tpr)
-    print("AUC =", auc_value)
-
-    # save ROC figure
-    import matplotlib.pyplot as plt
-    plt.figure(figsize=(8, 6))
-    plt.plot(fpr, tpr, label=f"AUC={auc_value:.3f}")
-    plt.xlabel("False Positive Rate")
-    plt.ylabel("True Positive Rate")
-    plt.title("Frame-level ROC (IoU ≥ 0.2)")
-    plt.grid(True)
-    plt.legend()
-    fig_path = os.path.join(args.output_dir, "ROC_curve.png")
-    plt.savefig(fig_path, dpi=300)
-    print("ROC saved to:", fig_path)
+    multi = len(args.iou_thr) > 1
+
+    def compute():
+        print("Loading ground truth...")
+        gt_boxes, index = load_ground_truth(args.coco_gt)
+
+        print("Loading predictions...")
+        pred_boxes = load_predictions(args.pred_json, index, score_floor=args.score_floor, top_k=args.top_k)
+
+        print("Building frame-level labels and scores...")
+        y_true, y_score = build_frame_scores(gt_boxes, pred_boxes, iou_thr=args.iou_thr if multi else args.iou_thr[0])
+        return y_true, y_score, index.ids
+
+    # labels / scores as .npy arrays (one row per frame, frames sorted by image id),
+    # reused from the cache when the inputs and parameters are unchanged
+    scores_dir = os.path.join(args.output_dir, "labels_scores")
+    params = {"iou_thr": args.iou_thr, "score_floor": args.score_floor, "top_k": args.top_k}
+    if args.no_cache:
+        y_true, y_score, image_ids = compute()
+        save_scores(scores_dir, y_true, y_score, image_ids, {"params": params})
+    else:
+        cache_dir = args.cache_dir or os.path.join(args.output_dir, ".cache")
+        folder, hit = cached_frame_scores(args.coco_gt, args.pred_json, params, compute, cache_dir)
+        if hit:
+            print("Frame-level labels and scores loaded from cache:", folder)
+        export_scores(folder, scores_dir)
+    print("Saved:", scores_dir)
+    scores = load_scores(scores_dir)
+    y_true, y_score = scores["y_true"], scores["y_score"]
+
+    if multi:
+        results = roc_family(y_true, y_score, args.iou_thr)
+
+        json_path = os.path.join(args.output_dir, "roc_multi_iou.json")
+        with open(json_path, "w") as f:
+            json.dump(results, f)
+        print("Saved:", json_path)
+        for r in results:
+            ops = ", ".join(f"{p['rule']}: tpr={p['tpr']:.3f} fpr={p['fpr']:.3f}" for p in r["operating_points"])
+            print(f"IoU >= {r['iou_thr']:g}: AUC = {r['auc']:.4f} ({ops})")
+
+        # one figure with the ROC of every threshold
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(8, 6))
+        for r in results:
+            plt.plot(r["fpr"], r["tpr"], label=f"IoU ≥ {r['iou_thr']:g}, AUC={r['auc']:.3f}")
+        plt.xlabel("False Positive Rate")
+        plt.ylabel("True Positive Rate")
+        plt.title("Frame-level ROC for several IoU thresholds")
+        plt.grid(True)
+        plt.legend()
+        fig_path = os.path.join(args.output_dir, "ROC_curves_multi_iou.png")
+        plt.savefig(fig_path, dpi=300)
+        print("ROC saved to:", fig_path)
+    else:
+        iou_thr = args.iou_thr[0]
+
+        # compute ROC
+        fpr, tpr, _ = roc_curve(y_true, y_score)
+        auc_value = auc(fpr, tpr)
+        print("AUC =", auc_value)
+
+        # save ROC figure
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(8, 6))
+        plt.plot(fpr, tpr, label=f"AUC={auc_value:.3f}")
+        plt.xlabel("False Positive Rate")
+        plt.ylabel("True Positive Rate")
+        plt.title(f"Frame-level ROC (IoU ≥ {iou_thr:g})")
+        plt.grid(True)
+        plt.legend()
+        fig_path = os.path.join(args.output_dir, "ROC_curve.png")
+        plt.savefig(fig_path, dpi=300)
+        print("ROC saved to:", fig_path)
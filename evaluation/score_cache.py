@@ -0,0 +1,154 @@
+"""
+Cache of the frame-level labels and scores of roc_universal.py.
+
+The frame scores only depend on the GT file, the predictions file and the scoring
+parameters (IoU threshold(s), score floor, top-k). Each result is stored under a
+key hashing the content of both files and the parameters, as plain .npy arrays
+that np.load can memory-map:
+
+    <cache_dir>/<key>/y_true.npy     [F] frame labels (0 / 1)
+    <cache_dir>/<key>/y_score.npy    [F] or [F x K] frame scores (one column per IoU threshold)
+    <cache_dir>/<key>/image_ids.npy  [F] image ids of the rows (sorted, see id_index.py)
+    <cache_dir>/<key>/meta.json      inputs, parameters and shapes
+
+A later run with the same inputs loads the arrays instead of recomputing them.
+File hashes are remembered by (path, size, modification time) in
+<cache_dir>/hashes/ (one small json per file path), so unchanged multi-GB files are
+not read again either.
+
+Several processes may share a cache folder: every file is written under a temporary
+name and renamed into place, and a result folder that another process already
+stored under the same key is kept (same key, same content).
+
+Usage (from Python, e.g. in a notebook or a plotting script):
+    from score_cache import load_scores
+    scores = load_scores("<output_dir>/labels_scores")   # dict of memory-mapped arrays
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+CACHE_VERSION = 1
+ARRAYS = ("y_true", "y_score", "image_ids")
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the SHA-256 of a file content."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cached_hash(path, cache_dir):
+    """SHA-256 of a file, reused from <cache_dir>/hashes/ while its size and mtime are unchanged."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    # one entry file per path: concurrent processes never rewrite each other's entries
+    index_dir = os.path.join(cache_dir, "hashes")
+    entry_path = os.path.join(index_dir, hashlib.sha256(path.encode()).hexdigest()[:32] + ".json")
+    if os.path.exists(entry_path):
+        with open(entry_path, "r") as f:
+            entry = json.load(f)
+        if entry["path"] == path and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return entry["sha256"]
+
+    digest = hash_file(path)
+    os.makedirs(index_dir, exist_ok=True)
+    tmp = entry_path + f".{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}, f)
+    os.replace(tmp, entry_path)
+    return digest
+
+
+def cache_key(gt_hash, pred_hash, params):
+    """Key of a result: hash of the two input hashes and the JSON-serializable parameters."""
+    desc = {"version": CACHE_VERSION, "gt": gt_hash, "pred": pred_hash, "params": params}
+    return hashlib.sha256(json.dumps(desc, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def save_scores(folder, y_true, y_score, image_ids, meta, replace=True):
+    """
+    Write the arrays and meta.json to folder (written next to it, then renamed into place).
+
+    With replace=False an existing folder is kept and the new files are discarded: cache
+    entries are written this way, as a concurrent writer of the same key stores the same content.
+    """
+    tmp = folder.rstrip(os.sep) + f".{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    arrays = {"y_true": np.asarray(y_true), "y_score": np.asarray(y_score), "image_ids": np.asarray(image_ids)}
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    meta = dict(meta, shapes={name: list(a.shape) for name, a in arrays.items()})
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+    if replace and os.path.exists(folder):
+        shutil.rmtree(folder)
+    try:
+        os.rename(tmp, folder)  # fails if folder exists (not empty) by now
+    except OSError:
+        if not os.path.exists(os.path.join(folder, "meta.json")):
+            raise
+        shutil.rmtree(tmp)
+
+
+def load_scores(folder, mmap_mode="r"):
+    """
+    Open a result folder.
+
+    Returns:
+        dict: 'y_true', 'y_score', 'image_ids' (memory-mapped unless mmap_mode is None) and 'meta'.
+    """
+    scores = {name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+    with open(os.path.join(folder, "meta.json"), "r") as f:
+        scores["meta"] = json.load(f)
+    return scores
+
+
+def export_scores(folder, dst):
+    """Materialize a cached result at dst as hard links (copies across file systems)."""
+    if os.path.exists(dst):
+        shutil.rmtree(dst)
+    os.makedirs(dst)
+    for name in os.listdir(folder):
+        try:
+            os.link(os.path.join(folder, name), os.path.join(dst, name))
+        except OSError:
+            shutil.copy2(os.path.join(folder, name), os.path.join(dst, name))
+
+
+def cached_frame_scores(gt_path, pred_path, params, compute, cache_dir):
+    """
+    Frame labels and scores of (gt_path, pred_path, params), from the cache or computed.
+
+    Args:
+        gt_path, pred_path (str): Input files, hashed by content.
+        params (dict): Scoring parameters (JSON-serializable), part of the key.
+        compute (callable): compute() -> (y_true, y_score, image_ids), called on a cache miss.
+        cache_dir (str): Cache folder.
+
+    Returns:
+        (str, bool): the result folder (see load_scores) and whether it was a cache hit.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    gt_hash, pred_hash = cached_hash(gt_path, cache_dir), cached_hash(pred_path, cache_dir)
+    folder = os.path.join(cache_dir, cache_key(gt_hash, pred_hash, params))
+    if os.path.exists(os.path.join(folder, "meta.json")):
+        return folder, True
+
+    tic = time.time()
+    y_true, y_score, image_ids = compute()
+    meta = {"gt": os.path.abspath(gt_path), "gt_sha256": gt_hash,
+            "pred": os.path.abspath(pred_path), "pred_sha256": pred_hash,
+            "params": params, "version": CACHE_VERSION, "time": time.time() - tic}
+    save_scores(folder, y_true, y_score, image_ids, meta, replace=False)
+    return folder, False
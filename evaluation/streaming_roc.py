@@ -0,0 +1,208 @@
+"""
+Streaming, mergeable frame-level ROC / AUC from score histograms.
+
+sklearn's roc_curve sorts the whole score vector and returns one point per
+distinct score, which for tens of millions of frames pooled across videos and
+experiments costs a lot of memory and time. StreamingROC only keeps, for a fixed
+set of score bins, the number of positive and negative frames and the smallest
+and largest score seen in each bin. It is updated with any slice of frames (e.g.
+one video at a time), and accumulators with the same bins are merged by adding
+them, so partial results of worker processes or separate jobs can be combined.
+
+Bins are either fixed (n_bins uniform bins over [lo, hi], scores outside are
+counted in the end bins) or adaptive (StreamingROC.from_sample: edges at the
+quantiles of a sample of the scores, so every bin holds about the same number of
+frames).
+
+Accuracy:
+
+- ROC points. Thresholding at the smallest score of a bin selects exactly the
+  frames of that bin and the ones above, so every point of curve() is a point of
+  the exact ROC curve; only the points between them are missing. The operating
+  points are picked among these exact points (e.g. the FPR reported at 90%
+  sensitivity is achieved by its threshold; the exact curve may reach a slightly
+  lower one inside a bin).
+- AUC. AUC = P(s_pos > s_neg) + 0.5 * P(s_pos == s_neg). Pairs of frames in
+  different bins are ordered exactly; the trapezoidal AUC counts the pairs inside
+  the same bin as ties (0.5 each) while their true contribution is in [0, 1]. So
+
+      |auc() - exact AUC| <= auc_error_bound() = 0.5 * sum_b pos_b * neg_b / (P * N)
+
+  over the bins b whose scores are not all equal (bins holding a single score
+  value, such as the 0 score of the frames without predictions, are exact ties
+  and contribute no error). More or adaptive bins tighten the bound.
+
+Usage (labels_scores folders written by roc_universal.py, read memory-mapped chunk by chunk):
+    python streaming_roc.py <output_dir>/labels_scores [<other>/labels_scores ...] [--n-bins 1000] \
+        [--adaptive] [--column 0] [--output operating_points.csv] [--exact]
+"""
+
+import argparse
+import csv
+
+import numpy as np
+
+from roc_universal import operating_points
+from score_cache import load_scores
+
+
+class StreamingROC:
+    """
+    Histogram ROC accumulator.
+
+    Args:
+        n_bins (int): Number of uniform bins over [lo, hi] (ignored if edges is given).
+        lo, hi (float): Score range of the uniform bins.
+        edges (np.ndarray): Increasing bin edges; bin b is [edges[b], edges[b + 1]), the last one closed.
+    """
+
+    def __init__(self, n_bins=1000, lo=0.0, hi=1.0, edges=None):
+        if edges is None:
+            edges = np.linspace(lo, hi, n_bins + 1)
+        edges = np.asarray(edges, dtype=np.float64)
+        if edges.ndim != 1 or len(edges) < 2 or np.any(np.diff(edges) <= 0):
+            raise ValueError("edges must be a strictly increasing array of at least 2 values")
+        B = len(edges) - 1
+        self.edges = edges
+        self.pos = np.zeros(B, dtype=np.int64)
+        self.neg = np.zeros(B, dtype=np.int64)
+        self.min = np.full(B, np.inf)
+        self.max = np.full(B, -np.inf)
+
+    @classmethod
+    def from_sample(cls, scores, n_bins=1000):
+        """Adaptive bins: edges at the quantiles of a sample of the scores (repeated quantiles merged)."""
+        scores = np.asarray(scores, dtype=np.float64)
+        edges = np.unique(np.quantile(scores[np.isfinite(scores)], np.linspace(0, 1, n_bins + 1)))
+        if len(edges) < 2:
+            edges = np.r_[edges, edges[-1] + 1.0]
+        return cls(edges=edges)
+
+    @property
+    def n_bins(self):
+        return len(self.pos)
+
+    def update(self, y_true, y_score):
+        """Add frames: y_true [n] labels (0 / 1) and y_score [n] scores (nan scores are ignored)."""
+        y_true = np.asarray(y_true).reshape(-1).astype(bool)
+        y_score = np.asarray(y_score, dtype=np.float64).reshape(-1)
+        valid = ~np.isnan(y_score)
+        if not valid.all():
+            y_true, y_score = y_true[valid], y_score[valid]
+        b = np.clip(np.searchsorted(self.edges, y_score, "right") - 1, 0, self.n_bins - 1)
+        n_pos = np.bincount(b[y_true], minlength=self.n_bins)
+        self.pos += n_pos
+        self.neg += np.bincount(b, minlength=self.n_bins) - n_pos
+        np.minimum.at(self.min, b, y_score)
+        np.maximum.at(self.max, b, y_score)
+        return self
+
+    def merge(self, other):
+        """Add the counts of another accumulator with the same bins (in place)."""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge accumulators with different bins")
+        self.pos += other.pos
+        self.neg += other.neg
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def save(self, path):
+        np.savez(path, edges=self.edges, pos=self.pos, neg=self.neg, min=self.min, max=self.max)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        acc = cls(edges=data["edges"])
+        acc.pos, acc.neg, acc.min, acc.max = data["pos"], data["neg"], data["min"], data["max"]
+        return acc
+
+    def curve(self):
+        """
+        ROC points at the smallest score of every non-empty bin, by decreasing threshold.
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray): fpr, tpr and thresholds, in the format of
+                sklearn's roc_curve (first point (0, 0) at threshold inf).
+        """
+        P, N = self.pos.sum(), self.neg.sum()
+        if P == 0 or N == 0:
+            raise ValueError("The ROC curve needs positive and negative frames")
+        filled = np.flatnonzero(self.pos + self.neg)[::-1]
+        tpr = np.r_[0.0, np.cumsum(self.pos[filled]) / P]
+        fpr = np.r_[0.0, np.cumsum(self.neg[filled]) / N]
+        return fpr, tpr, np.r_[np.inf, self.min[filled]]
+
+    def auc(self):
+        """Trapezoidal AUC of curve() (within auc_error_bound() of the exact AUC)."""
+        fpr, tpr, _ = self.curve()
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    def auc_error_bound(self):
+        """Bound on |auc() - exact AUC|: half the fraction of (positive, negative) pairs sharing a non-tied bin."""
+        P, N = self.pos.sum(), self.neg.sum()
+        mixed = self.max > self.min
+        return float(0.5 * np.sum(self.pos[mixed] * self.neg[mixed].astype(np.float64)) / (P * N))
+
+    def operating_points(self, max_fpr=(0.01, 0.05, 0.1), min_tpr=(0.9, 0.95)):
+        """Operating points of curve() (see roc_universal.operating_points)."""
+        return operating_points(*self.curve(), max_fpr=max_fpr, min_tpr=min_tpr)
+
+
+def accumulate_folders(folders, n_bins=1000, adaptive=False, column=0, chunk_size=1 << 22):
+    """
+    StreamingROC of the pooled frames of several labels_scores folders (see score_cache.py),
+    read chunk by chunk from the memory-mapped arrays.
+    """
+    def columns(scores):
+        y_score = scores["y_score"]
+        return scores["y_true"], (y_score[:, column] if y_score.ndim == 2 else y_score)
+
+    acc = None
+    for folder in folders:
+        y_true, y_score = columns(load_scores(folder))
+        if acc is None:
+            # adaptive bins from a strided sample of the first folder
+            acc = StreamingROC.from_sample(y_score[::max(1, len(y_score) // 1000000)], n_bins) if adaptive \
+                else StreamingROC(n_bins)
+        for start in range(0, len(y_true), chunk_size):
+            acc.update(y_true[start:start + chunk_size], y_score[start:start + chunk_size])
+    return acc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folders", type=str, nargs="+", help="labels_scores folders (roc_universal.py output)")
+    parser.add_argument("--n-bins", type=int, default=1000, help="Number of score bins")
+    parser.add_argument("--adaptive", action="store_true", help="Bins at the score quantiles instead of uniform over [0, 1]")
+    parser.add_argument("--column", type=int, default=0, help="IoU threshold column of multi-IoU scores")
+    parser.add_argument("--output", type=str, default=None, help="CSV file for the operating points")
+    parser.add_argument("--exact", action="store_true", help="Also compute the exact AUC (sklearn, loads all the scores)")
+    args = parser.parse_args()
+
+    acc = accumulate_folders(args.folders, args.n_bins, args.adaptive, args.column)
+    print(f"Frames: {acc.pos.sum() + acc.neg.sum()} ({acc.pos.sum()} positive), {acc.n_bins} bins")
+    print(f"AUC = {acc.auc():.6f} ± {acc.auc_error_bound():.6f}")
+    if args.exact:
+        from sklearn.metrics import roc_auc_score
+        y_true, y_score = [], []
+        for folder in args.folders:
+            scores = load_scores(folder)
+            y_true.append(scores["y_true"])
+            y_score.append(scores["y_score"][:, args.column] if scores["y_score"].ndim == 2 else scores["y_score"])
+        print(f"Exact AUC = {roc_auc_score(np.concatenate(y_true), np.concatenate(y_score)):.6f}")
+
+    points = acc.operating_points()
+    print(f"\n{'rule':<12}{'score_thr':>10}{'FPR':>8}{'TPR':>8}")
+    for p in points:
+        thr = "-" if p["score_thr"] is None else f"{p['score_thr']:.4f}"
+        print(f"{p['rule']:<12}{thr:>10}{p['fpr']:>8.4f}{p['tpr']:>8.4f}")
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(points[0]))
+            writer.writeheader()
+            writer.writerows(points)
+        print("Saved:", args.output)
@@ -0,0 +1,118 @@
+"""
+Regression tests of the vectorized matcher of cocoeval.py against the original COCO loop.
+
+greedyMatch must give the same matches as greedyMatchLoop (run, as in the original
+evaluateImg, on the gts sorted ignore last), and evaluate() / accumulate() must give
+the same results with either matcher.
+
+Usage (from the evaluation folder):
+    python -m pytest -q test_cocoeval.py
+"""
+
+import contextlib
+import io
+
+import numpy as np
+import pytest
+from pycocotools.coco import COCO
+
+import cocoeval
+from cocoeval import COCOeval, greedyMatch, greedyMatchLoop
+
+
+def loopMatch(ious, gtIg, iscrowd, iouThrs):
+    '''
+    greedyMatch interface on top of greedyMatchLoop: each threshold row has its own
+    ignore flags, and the loop runs on the gts sorted ignore last like the original code
+    '''
+    ious = np.asarray(ious, dtype=np.float64)
+    T = len(iouThrs)
+    D, G = ious.shape
+    gtIg = np.broadcast_to(np.asarray(gtIg, dtype=bool), (T, G))
+    iscrowd = np.asarray(iscrowd)
+    dtMatch = -np.ones((T, D), dtype=np.int64)
+    gtMatch = -np.ones((T, G), dtype=np.int64)
+    if G == 0:
+        return dtMatch, gtMatch
+    for t in range(T):
+        gtind = np.argsort(gtIg[t], kind='mergesort')
+        dm, gm = greedyMatchLoop(ious[:, gtind], gtIg[t][gtind], iscrowd[gtind], [iouThrs[t]])
+        dtMatch[t] = np.where(dm[0] > -1, gtind[np.maximum(dm[0], 0)], -1)
+        gtMatch[t, gtind] = gm[0]
+    return dtMatch, gtMatch
+
+
+def randomCase(rng):
+    D, G = rng.integers(0, 12), rng.integers(0, 8)
+    # few distinct values: many tied ious
+    ious = rng.choice([0.0, 0.3, 0.5, 0.5, 0.7, 0.75, 0.9, 1.0], size=(D, G))
+    gtIg = rng.random((10, G)) < 0.3
+    iscrowd = (rng.random(G) < 0.25).astype(int)
+    return ious, gtIg, iscrowd
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_greedy_match_equals_loop(seed):
+    rng = np.random.default_rng(seed)
+    ious, gtIg, iscrowd = randomCase(rng)
+    iouThrs = np.linspace(.5, 0.95, 10)
+    for ig in (gtIg[0], gtIg):  # one ignore row for all thresholds, or one per threshold
+        dtMatch, gtMatch = greedyMatch(ious, ig, iscrowd, iouThrs)
+        dtRef, gtRef = loopMatch(ious, ig, iscrowd, iouThrs)
+        np.testing.assert_array_equal(dtMatch, dtRef)
+        np.testing.assert_array_equal(gtMatch, gtRef)
+
+
+def randomDataset(rng, nImgs=40):
+    '''Small gt / results with crowd gts, ignored gts, all area ranges and duplicated (tied) boxes'''
+    images, anns, dets = [], [], []
+    for i in range(nImgs):
+        imgId = f'00{i % 3}-001_{i}'
+        images.append({'id': imgId, 'width': 640, 'height': 480})
+        boxes = []
+        for _ in range(rng.integers(0, 5)):
+            w, h = rng.choice([8, 30, 60, 150]), rng.choice([8, 30, 60, 150])
+            x, y = rng.uniform(0, 640 - w), rng.uniform(0, 480 - h)
+            ann = {'id': len(anns) + 1, 'image_id': imgId, 'category_id': 0, 'bbox': [x, y, w, h],
+                   'area': float(w * h), 'iscrowd': int(rng.random() < 0.15)}
+            if rng.random() < 0.15:
+                ann['ignore'] = 1
+            anns.append(ann)
+            boxes.append([x, y, w, h])
+        for _ in range(rng.integers(0, 8)):
+            if boxes and rng.random() < 0.7:
+                x, y, w, h = boxes[rng.integers(len(boxes))]
+                box = [x + rng.choice([0, 2, 5]), y + rng.choice([0, 2, 5]), w, h]  # repeated offsets: ties
+            else:
+                box = [rng.uniform(0, 500), rng.uniform(0, 400), rng.uniform(5, 140), rng.uniform(5, 80)]
+            dets.append({'image_id': imgId, 'category_id': 0, 'bbox': box,
+                         'score': float(rng.choice([0.3, 0.5, 0.9, rng.random()]))})
+    coco = COCO()
+    coco.dataset = {'images': images, 'annotations': anns, 'categories': [{'id': 0, 'name': 'polyp'}]}
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco.createIndex()
+        return coco, coco.loadRes(dets)
+
+
+def runEval(cocoGt, cocoDt):
+    with contextlib.redirect_stdout(io.StringIO()):
+        E = COCOeval(cocoGt, cocoDt, 'bbox')
+        E.evaluate()
+        E.accumulate()
+        E.summarize()
+    return E
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_evaluate_equals_loop(seed, monkeypatch):
+    cocoGt, cocoDt = randomDataset(np.random.default_rng(seed))
+    E = runEval(cocoGt, cocoDt)
+    monkeypatch.setattr(cocoeval, 'greedyMatch', loopMatch)
+    R = runEval(cocoGt, cocoDt)
+
+    # per detection / gt evaluation tables: matches and ignore flags of every area range and threshold
+    np.testing.assert_array_equal(E.evalDets, R.evalDets)
+    np.testing.assert_array_equal(E.evalGts, R.evalGts)
+    for key in ('precision', 'recall', 'scores'):
+        np.testing.assert_array_equal(E.eval[key], R.eval[key])
+    np.testing.assert_array_equal(E.stats, R.stats)
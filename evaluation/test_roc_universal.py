@@ -0,0 +1,49 @@
+"""
+Tests of the ROC operating points of roc_universal.py, including the frame sets with a
+single class (e.g. a polyp-only split, where every frame is positive).
+
+Usage (from the evaluation folder):
+    python -m pytest -q test_roc_universal.py
+"""
+
+import numpy as np
+import pytest
+
+from roc_batch import summary_rows
+from roc_universal import roc_family
+
+# roc_curve warns when y_true has a single class
+pytestmark = pytest.mark.filterwarnings('ignore::sklearn.exceptions.UndefinedMetricWarning')
+
+
+def rules(result):
+    return [p['rule'] for p in result['operating_points']]
+
+
+def test_operating_points_two_classes():
+    rng = np.random.default_rng(0)
+    y_true = (rng.random(200) < 0.3).astype(int)
+    y_score = np.clip(rng.normal(0.3 + 0.3 * y_true, 0.2), 0, 1)[:, None]
+    result, = roc_family(y_true, y_score, [0.2])
+    assert rules(result) == ['fpr<=0.01', 'fpr<=0.05', 'fpr<=0.1', 'tpr>=0.9', 'tpr>=0.95', 'youden']
+    for p in result['operating_points']:
+        assert 0 <= p['fpr'] <= 1 and 0 <= p['tpr'] <= 1
+
+
+def test_operating_points_only_positive_frames():
+    rng = np.random.default_rng(0)
+    results = roc_family(np.ones(5, int), rng.random((5, 2)), [0.2, 0.5])
+    for result in results:
+        assert np.isnan(result['auc'])
+        # no negatives: fpr is undefined, only the tpr rules remain
+        assert rules(result) == ['tpr>=0.9', 'tpr>=0.95']
+    row, _ = summary_rows([{'name': 'polyp_only', 'frames': 5, 'positives': 5, 'cached': False,
+                            'time': 0.0, 'results': results}])
+    assert row['tpr@fpr<=0.05'] == -1.0
+
+
+def test_operating_points_only_negative_frames():
+    result, = roc_family(np.zeros(5, int), np.random.default_rng(0).random((5, 1)), [0.2])
+    assert np.isnan(result['auc'])
+    # no positives: tpr is undefined, the fpr rules keep the (0, nan) start of the curve
+    assert rules(result) == ['fpr<=0.01', 'fpr<=0.05', 'fpr<=0.1']
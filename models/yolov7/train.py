@@ -1,11 +1,16 @@
 import argparse
+import json
 import logging
 import math
 import os
+import queue
 import random
+import shutil
 import time
+from collections import deque
 from copy import deepcopy
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import numpy as np
@@ -38,6 +43,182 @@ from utils.wandb_logging.wandb_utils import WandbLogger, check_wandb_resume
 logger = logging.getLogger(__name__)
 
 
+def to_cpu(x):
+    # Recursive copy of the tensors of a (state) dict / list to CPU, detached from the live training state
+    if isinstance(x, torch.Tensor):
+        return x.detach().to('cpu', copy=True)
+    if isinstance(x, dict):
+        return {k: to_cpu(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return type(x)(to_cpu(v) for v in x)
+    return x
+
+
+def unshare(f):
+    # Give a hardlinked file its own copy (before modifying it in place, e.g. strip_optimizer)
+    f = Path(f)
+    if f.exists() and os.stat(f).st_nlink > 1:
+        tmp = f.with_name(f.name + '.tmp')
+        shutil.copyfile(f, tmp)
+        os.replace(tmp, f)
+
+
+class CheckpointWriter:
+    # Writes checkpoints on a background thread so that training resumes as soon as the CPU snapshot is taken.
+    # Each checkpoint is serialized once (to a temporary file renamed into place, so a crash never leaves a
+    # truncated last.pt) and its other names (best.pt, epoch_*.pt, ...) are hardlinks of the same file.
+    # At most one snapshot waits in the queue, so host memory stays bounded if the disk is slower than an epoch.
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, ckpt, path, links=()):
+        self._check()
+        self.queue.put((ckpt, Path(path), [Path(f) for f in links]))
+
+    def flush(self):
+        # wait until every queued checkpoint is on disk
+        self.queue.join()
+        self._check()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Checkpoint writer failed') from error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def _write(ckpt, path, links):
+        tmp = path.with_name(path.name + '.tmp')
+        torch.save(ckpt, tmp)
+        os.replace(tmp, path)
+        for f in links:
+            tmp = f.with_name(f.name + '.tmp')
+            if tmp.exists():
+                tmp.unlink()
+            try:
+                os.link(path, tmp)
+            except OSError:  # no hardlinks on this file system
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, f)
+
+
+class PhaseTimer:
+    # Low overhead timing of the phases of the training loop: mark(phase) charges the time since the previous mark
+    # to phase (one perf_counter call). CUDA kernels run asynchronously, so by default their time lands in the
+    # first phase that waits for the device (usually 'log', which reads the losses); with sync (--sync-timing)
+    # every mark synchronizes the device and each phase gets its own device time, at the cost of the CPU / GPU
+    # overlap. The last `window` durations of every phase are kept for rolling statistics
+    def __init__(self, device, sync=False, window=200):
+        self.device = device
+        self.sync = sync and device.type == 'cuda'
+        self.window = window
+        self.total, self.count, self.recent = {}, {}, {}
+        self.t = time.perf_counter()
+
+    def start(self):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        self.t = time.perf_counter()
+
+    def mark(self, phase):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        t = time.perf_counter()
+        dt, self.t = t - self.t, t
+        self.total[phase] = self.total.get(phase, 0.0) + dt
+        self.count[phase] = self.count.get(phase, 0) + 1
+        self.recent.setdefault(phase, deque(maxlen=self.window)).append(dt)
+
+    def epoch_stats(self):
+        # Totals since the previous call (then reset) and rolling statistics (ms) of every phase
+        wall = sum(self.total.values())
+        stats = {}
+        for phase, total in self.total.items():
+            recent = np.array(self.recent[phase]) * 1000
+            stats[phase] = {'total_s': total,
+                            'count': self.count[phase],
+                            'share': total / wall if wall else 0.0,
+                            'mean_ms': total / self.count[phase] * 1000,
+                            'rolling_mean_ms': float(recent.mean()),
+                            'rolling_p50_ms': float(np.percentile(recent, 50)),
+                            'rolling_p90_ms': float(np.percentile(recent, 90)),
+                            'rolling_max_ms': float(recent.max())}
+        self.total, self.count = {}, {}
+        return stats
+
+
+def val_subset(val_json, fraction):
+    # Fixed validation subset (--val-subset): the images of the val COCO json are grouped by video and positive /
+    # negative frame, and round(fraction * n) images (at least 1) of each group are taken evenly spaced in frame
+    # order. Every video keeps its positive / negative ratio, and the choice does not depend on any random seed
+    with open(val_json) as f:
+        data = json.load(f)
+    positive = {ann['image_id'] for ann in data['annotations']}
+    groups = {}
+    for img in data['images']:
+        video, _, frame = Path(img['file_name']).stem.rpartition('_')  # '001-010_18185.jpg'
+        groups.setdefault((video, img['id'] in positive), []).append((int(frame) if frame.isdigit() else 0,
+                                                                      img['file_name']))
+    files = []
+    for key in sorted(groups):
+        frames = sorted(groups[key])
+        k = max(1, round(fraction * len(frames)))
+        files += [frames[i][1] for i in ((np.arange(k) + 0.5) * len(frames) / k).astype(int)]
+    return files
+
+
+def val_fraction(x):
+    # argparse type of --val-subset: a fraction in (0, 1], or 0 (off)
+    x = float(x)
+    if not (x == 0 or 0 < x <= 1):
+        raise argparse.ArgumentTypeError(f'{x} is not in (0, 1] (0 = off)')
+    return x
+
+
+def positive_int(x):
+    # argparse type of --full-val-every: an integer >= 1
+    n = int(x)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f'{x} is not a positive integer')
+    return n
+
+
+def validate_snapshot(model, data_dict, batch_size, imgsz, dataloader, save_dir, opt, is_coco):
+    # test.test of a frozen EMA copy for --async-val, with a loss built on the copy (its own device). No plots and
+    # no W&B logger: they are not thread safe (the final epoch is always validated synchronously)
+    return test.test(data_dict,
+                     batch_size=batch_size,
+                     imgsz=imgsz,
+                     model=model,
+                     single_cls=opt.single_cls,
+                     dataloader=dataloader,
+                     save_dir=save_dir,
+                     verbose=False,
+                     plots=False,
+                     compute_loss=ComputeLoss(model),
+                     is_coco=is_coco,
+                     v5_metric=opt.v5_metric)
+
+
 def train(hyp, opt, device, tb_writer=None):
     logger.info(colorstr('hyperparameters: ') + ', '.join(f'{k}={v}' for k, v in hyp.items()))
     save_dir, epochs, batch_size, total_batch_size, weights, rank, freeze = \
@@ -253,8 +434,9 @@ def train(hyp, opt, device, tb_writer=None):
     nl = model.model[-1].nl  # number of detection layers (used for scaling hyp['obj'])
     imgsz, imgsz_test = [check_img_size(x, gs) for x in opt.img_size]  # verify imgsz are gs-multiples
 
-    # DP mode
-    if cuda and rank == -1 and torch.cuda.device_count() > 1:
+    # DP mode (not over the validation GPU of --async-val --val-device <gpu>)
+    val_gpu = getattr(opt, 'async_val', False) and getattr(opt, 'val_device', '').isdigit()
+    if cuda and rank == -1 and torch.cuda.device_count() > 1 and not val_gpu:
         model = torch.nn.DataParallel(model)
 
     # SyncBatchNorm
@@ -278,6 +460,21 @@ def train(hyp, opt, device, tb_writer=None):
                                        world_size=opt.world_size, workers=opt.workers,
                                        pad=0.5, prefix=colorstr('val: '))[0]
 
+        # Fast validation subset: validated every epoch, the full val set every --full-val-every epochs
+        subsetloader = None
+        if getattr(opt, 'val_subset', 0) > 0:
+            val_json = opt.val_json or str(Path(test_path) / 'val_ann.json')
+            img_dir = Path(test_path) / 'images' if (Path(test_path) / 'images').is_dir() else Path(test_path)
+            files = val_subset(val_json, opt.val_subset)
+            subset_file = save_dir / 'val_subset.txt'
+            subset_file.write_text(''.join(f'{(img_dir / f).resolve()}\n' for f in files))
+            subsetloader = create_dataloader(str(subset_file), imgsz_test, batch_size * 2, gs, opt,
+                                             hyp=hyp, cache=opt.cache_images and not opt.notest, rect=True, rank=-1,
+                                             world_size=opt.world_size, workers=opt.workers,
+                                             pad=0.5, prefix=colorstr('val subset: '))[0]
+            logger.info(f'Validation subset: {len(files)} images of {val_json} every epoch, '
+                        f'full validation every {opt.full_val_every} epochs')
+
         if not opt.resume:
             labels = np.concatenate(dataset.labels, 0)
             c = torch.tensor(labels[:, 0])  # classes
@@ -325,6 +522,101 @@ def train(hyp, opt, device, tb_writer=None):
                 f'Logging results to {save_dir}\n'
                 f'Starting training for {epochs} epochs...')
     torch.save(model, wdir / 'init.pt')
+    ckpt_writer = CheckpointWriter() if rank in [-1, 0] else None
+    timer = PhaseTimer(device, sync=getattr(opt, 'sync_timing', False))  # per phase timing, see PhaseTimer
+
+    # Asynchronous validation (--async-val): one background thread, epochs waiting for their results in pending
+    val_executor, val_device, pending = None, device, []
+    if rank in [-1, 0] and getattr(opt, 'async_val', False):
+        val_executor = ThreadPoolExecutor(max_workers=1)
+        if val_gpu:
+            val_device = torch.device('cuda', torch.cuda.device_count() - 1)  # visible after the training GPU
+        elif getattr(opt, 'val_device', '') == 'cpu':
+            val_device = torch.device('cpu')
+        logger.info(f'Asynchronous validation on {val_device}')
+        if val_device.type == 'cuda' and val_device == device:
+            logger.warning('WARNING: --async-val on the training GPU keeps a second copy of the EMA model in its memory, '
+                           'use --val-device <other gpu> or cpu if memory is short')
+
+    def end_epoch(epoch, s, mloss, lr, snapshot, subset_results=None, selectable=True):
+        # Write results.txt, log, update the best fitness and save the checkpoint of an epoch (results of its
+        # validation, or the latest ones for the epochs that are not validated). With --val-subset, the subset
+        # results are logged apart and only the epochs with a full validation (selectable) can become best.pt
+        nonlocal best_fitness
+        final_epoch = epoch + 1 == epochs
+        timer.mark('val')  # validation (or wait for the asynchronous one) up to here
+
+        # Write
+        with open(results_file, 'a') as f:
+            f.write(s + '%10.4g' * 7 % results + '\n')  # append metrics, val_loss
+        if len(opt.name) and opt.bucket:
+            os.system('gsutil cp %s gs://%s/results/results%s.txt' % (results_file, opt.bucket, opt.name))
+
+        # Log
+        tags = ['train/box_loss', 'train/obj_loss', 'train/cls_loss',  # train loss
+                'metrics/precision', 'metrics/recall', 'metrics/mAP_0.5', 'metrics/mAP_0.5:0.95',
+                'val/box_loss', 'val/obj_loss', 'val/cls_loss',  # val loss
+                'x/lr0', 'x/lr1', 'x/lr2']  # params
+        for x, tag in zip(list(mloss[:-1]) + list(results) + lr, tags):
+            if tb_writer:
+                tb_writer.add_scalar(tag, x, epoch)  # tensorboard
+            if wandb_logger.wandb:
+                wandb_logger.log({tag: x})  # W&B
+        if subset_results is not None:
+            with open(save_dir / 'results_subset.txt', 'a') as f:
+                f.write('%10s' % f'{epoch}/{epochs - 1}' + '%10.4g' * 7 % tuple(subset_results) + '\n')
+            tags = ['subset/precision', 'subset/recall', 'subset/mAP_0.5', 'subset/mAP_0.5:0.95',
+                    'subset/box_loss', 'subset/obj_loss', 'subset/cls_loss']
+            for x, tag in zip(subset_results, tags):
+                if tb_writer:
+                    tb_writer.add_scalar(tag, x, epoch)  # tensorboard
+                if wandb_logger.wandb:
+                    wandb_logger.log({tag: x})  # W&B
+
+        # Update best mAP (full validation results only)
+        fi = fitness(np.array(results).reshape(1, -1))  # weighted combination of [P, R, mAP@.5, mAP@.5-.95]
+        if fi > best_fitness:
+            best_fitness = fi
+        is_best = selectable and best_fitness == fi
+        wandb_logger.end_epoch(best_result=is_best)
+
+        # Save model
+        if snapshot is not None:
+            ckpt = {'epoch': epoch,
+                    'best_fitness': best_fitness,
+                    'training_results': results_file.read_text(),
+                    **snapshot}
+
+            # Save last once, best and epoch checkpoints as hardlinks of it
+            links = []
+            if is_best:
+                links.append(best)
+            if is_best and (epoch >= 200):
+                links.append(wdir / 'best_{:03d}.pt'.format(epoch))
+            if epoch == 0 or ((epoch + 1) % 25) == 0 or epoch >= (epochs - 5):
+                links.append(wdir / 'epoch_{:03d}.pt'.format(epoch))
+            ckpt_writer.save(ckpt, last, links)
+            if wandb_logger.wandb:
+                if ((epoch + 1) % opt.save_period == 0 and not final_epoch) and opt.save_period != -1:
+                    ckpt_writer.flush()  # log_model uploads the files of the weights folder
+                    wandb_logger.log_model(
+                        last.parent, opt, epoch, fi, best_model=is_best)
+            del ckpt
+        timer.mark('checkpoint')
+
+    def end_epochs(block):
+        # End the pending epochs in order, as far as their validation results are available (all if block)
+        nonlocal results, maps
+        while pending and (block or pending[0]['future'] is None or pending[0]['future'].done()):
+            p = pending.pop(0)
+            subset_results = None
+            if p['future'] is not None:
+                if p['full']:
+                    results, maps, _ = p['future'].result()
+                else:
+                    subset_results = p['future'].result()[0]
+            end_epoch(p['epoch'], p['s'], p['mloss'], p['lr'], p['snapshot'], subset_results, p['selectable'])
+
     for epoch in range(start_epoch, epochs):  # epoch ------------------------------------------------------------------
         model.train()
 
@@ -354,7 +646,9 @@ def train(hyp, opt, device, tb_writer=None):
         if rank in [-1, 0]:
             pbar = tqdm(pbar, total=nb)  # progress bar
         optimizer.zero_grad()
+        timer.start()
         for i, (imgs, targets, paths, _) in pbar:  # batch -------------------------------------------------------------
+            timer.mark('data')  # dataloader wait
             ni = i + nb * epoch  # number integrated batches (since train start)
             imgs = imgs.to(device, non_blocking=True).float() / 255.0  # uint8 to float32, 0-255 to 0.0-1.0
 
@@ -376,10 +670,12 @@ def train(hyp, opt, device, tb_writer=None):
                 if sf != 1:
                     ns = [math.ceil(x * sf / gs) * gs for x in imgs.shape[2:]]  # new shape (stretched to gs-multiple)
                     imgs = F.interpolate(imgs, size=ns, mode='bilinear', align_corners=False)
+            timer.mark('h2d')  # host to device copy, warmup and multi-scale
 
             # Forward
             with amp.autocast(enabled=cuda):
                 pred = model(imgs)  # forward
+                timer.mark('forward')
                 if 'loss_ota' not in hyp or hyp['loss_ota'] == 1:
                     loss, loss_items = compute_loss_ota(pred, targets.to(device), imgs)  # loss scaled by batch_size
                 else:
@@ -388,17 +684,21 @@ def train(hyp, opt, device, tb_writer=None):
                     loss *= opt.world_size  # gradient averaged between devices in DDP mode
                 if opt.quad:
                     loss *= 4.
+            timer.mark('loss')
 
             # Backward
             scaler.scale(loss).backward()
+            timer.mark('backward')
 
             # Optimize
             if ni % accumulate == 0:
                 scaler.step(optimizer)  # optimizer.step
                 scaler.update()
                 optimizer.zero_grad()
+                timer.mark('optimizer')
                 if ema:
                     ema.update(model)
+                    timer.mark('ema')
 
             # Print
             if rank in [-1, 0]:
@@ -418,6 +718,7 @@ def train(hyp, opt, device, tb_writer=None):
                 elif plots and ni == 10 and wandb_logger.wandb:
                     wandb_logger.log({"Mosaics": [wandb_logger.wandb.Image(str(x), caption=x.name) for x in
                                                   save_dir.glob('train*.jpg') if x.exists()]})
+            timer.mark('log')  # progress bar and plots (reads the losses: waits for the device without sync)
 
             # end batch ------------------------------------------------------------------------------------------------
         # end epoch ----------------------------------------------------------------------------------------------------
@@ -431,77 +732,70 @@ def train(hyp, opt, device, tb_writer=None):
             # mAP
             ema.update_attr(model, include=['yaml', 'nc', 'hyp', 'gr', 'names', 'stride', 'class_weights'])
             final_epoch = epoch + 1 == epochs
-            if (not opt.notest and epoch % opt.test_rate == 0) or final_epoch:  # Calculate mAP
-                wandb_logger.current_epoch = epoch + 1
-                results, maps, times = test.test(data_dict,
-                                                 batch_size=batch_size * 2,
-                                                 imgsz=imgsz_test,
-                                                 model=ema.ema,
-                                                 single_cls=opt.single_cls,
-                                                 dataloader=testloader,
-                                                 save_dir=save_dir,
-                                                 verbose=nc < 50 and final_epoch,
-                                                 plots=plots and final_epoch,
-                                                 wandb_logger=wandb_logger,
-                                                 compute_loss=compute_loss,
-                                                 is_coco=is_coco,
-                                                 v5_metric=opt.v5_metric)
-
-            # Write
-            with open(results_file, 'a') as f:
-                f.write(s + '%10.4g' * 7 % results + '\n')  # append metrics, val_loss
-            if len(opt.name) and opt.bucket:
-                os.system('gsutil cp %s gs://%s/results/results%s.txt' % (results_file, opt.bucket, opt.name))
-
-            # Log
-            tags = ['train/box_loss', 'train/obj_loss', 'train/cls_loss',  # train loss
-                    'metrics/precision', 'metrics/recall', 'metrics/mAP_0.5', 'metrics/mAP_0.5:0.95',
-                    'val/box_loss', 'val/obj_loss', 'val/cls_loss',  # val loss
-                    'x/lr0', 'x/lr1', 'x/lr2']  # params
-            for x, tag in zip(list(mloss[:-1]) + list(results) + lr, tags):
-                if tb_writer:
-                    tb_writer.add_scalar(tag, x, epoch)  # tensorboard
-                if wandb_logger.wandb:
-                    wandb_logger.log({tag: x})  # W&B
-
-            # Update best mAP
-            fi = fitness(np.array(results).reshape(1, -1))  # weighted combination of [P, R, mAP@.5, mAP@.5-.95]
-            if fi > best_fitness:
-                best_fitness = fi
-            wandb_logger.end_epoch(best_result=best_fitness == fi)
-
-            # Save model
-            if (not opt.nosave) or (final_epoch and not opt.evolve):  # if save
-                ckpt = {'epoch': epoch,
-                        'best_fitness': best_fitness,
-                        'training_results': results_file.read_text(),
-                        'model': deepcopy(model.module if is_parallel(model) else model).half(),
-                        'ema': deepcopy(ema.ema).half(),
+            validate = (not opt.notest and epoch % opt.test_rate == 0) or final_epoch
+            full_val = subsetloader is None or final_epoch or (epoch + 1) % opt.full_val_every == 0
+            selectable = subsetloader is None or (validate and full_val)  # may update best.pt
+            # snapshot on CPU: the writer thread serializes it while training continues
+            snapshot = {'model': deepcopy(model.module if is_parallel(model) else model).half().cpu(),
+                        'ema': deepcopy(ema.ema).half().cpu(),
                         'updates': ema.updates,
-                        'optimizer': optimizer.state_dict(),
-                        'wandb_id': wandb_logger.wandb_run.id if wandb_logger.wandb else None}
-
-                # Save last, best and delete
-                torch.save(ckpt, last)
-                if best_fitness == fi:
-                    torch.save(ckpt, best)
-                if (best_fitness == fi) and (epoch >= 200):
-                    torch.save(ckpt, wdir / 'best_{:03d}.pt'.format(epoch))
-                if epoch == 0:
-                    torch.save(ckpt, wdir / 'epoch_{:03d}.pt'.format(epoch))
-                elif ((epoch + 1) % 25) == 0:
-                    torch.save(ckpt, wdir / 'epoch_{:03d}.pt'.format(epoch))
-                elif epoch >= (epochs - 5):
-                    torch.save(ckpt, wdir / 'epoch_{:03d}.pt'.format(epoch))
-                if wandb_logger.wandb:
-                    if ((epoch + 1) % opt.save_period == 0 and not final_epoch) and opt.save_period != -1:
-                        wandb_logger.log_model(
-                            last.parent, opt, epoch, fi, best_model=best_fitness == fi)
-                del ckpt
+                        'optimizer': to_cpu(optimizer.state_dict()),
+                        'wandb_id': wandb_logger.wandb_run.id if wandb_logger.wandb else None} \
+                if (not opt.nosave) or (final_epoch and not opt.evolve) else None
+            timer.mark('checkpoint')
+            if val_executor is not None and not final_epoch:
+                # Asynchronous validation: a frozen copy of the EMA is tested in the background while the next
+                # epoch trains; the epoch is written / logged / saved when its results arrive (in epoch order)
+                if validate and any(p['future'] is not None for p in pending):
+                    end_epochs(block=True)  # at most one validation in flight
+                future = val_executor.submit(validate_snapshot, deepcopy(ema.ema).to(val_device), data_dict,
+                                             batch_size * 2, imgsz_test, testloader if full_val else subsetloader,
+                                             save_dir, opt, is_coco) if validate else None
+                pending.append({'epoch': epoch, 's': s, 'mloss': mloss.tolist(), 'lr': lr, 'snapshot': snapshot,
+                                'future': future, 'full': full_val, 'selectable': selectable})
+                timer.mark('val')  # EMA copy and submission (end_epoch marks the epochs that end)
+                end_epochs(block=False)
+            else:
+                end_epochs(block=True)
+                subset_results = None
+                if validate:  # Calculate mAP
+                    wandb_logger.current_epoch = epoch + 1
+                    val = test.test(data_dict,
+                                    batch_size=batch_size * 2,
+                                    imgsz=imgsz_test,
+                                    model=ema.ema,
+                                    single_cls=opt.single_cls,
+                                    dataloader=testloader if full_val else subsetloader,
+                                    save_dir=save_dir,
+                                    verbose=nc < 50 and final_epoch,
+                                    plots=plots and final_epoch,
+                                    wandb_logger=wandb_logger,
+                                    compute_loss=compute_loss,
+                                    is_coco=is_coco,
+                                    v5_metric=opt.v5_metric)
+                    if full_val:
+                        results, maps, times = val
+                    else:
+                        subset_results = val[0]
+                end_epoch(epoch, s, mloss.tolist(), lr, snapshot, subset_results, selectable)  # marks 'val' once
+
+            # Phase timing: seconds per epoch to TensorBoard, full statistics to timing/epoch_*.json
+            timing = timer.epoch_stats()
+            if tb_writer:
+                for phase, x in timing.items():
+                    tb_writer.add_scalar(f'time/{phase}', x['total_s'], epoch)
+            (save_dir / 'timing').mkdir(exist_ok=True)
+            with open(save_dir / 'timing' / 'epoch_{:03d}.json'.format(epoch), 'w') as f:
+                json.dump({'epoch': epoch, 'sync': timer.sync, 'phases': timing}, f, indent=1)
+            logger.info('Epoch time: ' + ', '.join(f'{phase} {x["total_s"]:.1f}s' for phase, x in timing.items()))
 
         # end epoch ----------------------------------------------------------------------------------------------------
     # end training
     if rank in [-1, 0]:
+        end_epochs(block=True)
+        if val_executor is not None:
+            val_executor.shutdown()
+        ckpt_writer.close()  # checkpoints on disk before testing / stripping them
         # Plots
         if plots:
             plot_results(save_dir=save_dir)  # save as results.png
@@ -531,6 +825,7 @@ def train(hyp, opt, device, tb_writer=None):
         final = best if best.exists() else last  # final model
         for f in last, best:
             if f.exists():
+                unshare(f)  # last.pt / best.pt may be hardlinks of epoch checkpoints that keep their optimizer
                 strip_optimizer(f)  # strip optimizers
         if opt.bucket:
             os.system(f'gsutil cp {final} gs://{opt.bucket}/weights')  # upload
@@ -585,6 +880,15 @@ if __name__ == '__main__':
     parser.add_argument('--freeze', nargs='+', type=int, default=[0],
                         help='Freeze layers: backbone of yolov7=50, first3=0 1 2')
     parser.add_argument('--v5-metric', action='store_true', help='assume maximum recall as 1.0 in AP calculation')
+    parser.add_argument('--async-val', action='store_true', help='validate the EMA in a background thread during the next epoch')
+    parser.add_argument('--sync-timing', action='store_true', help='synchronize CUDA in the phase timers (accurate, slower)')
+    parser.add_argument('--val-subset', type=val_fraction, default=0.0,
+                        help='fraction in (0, 1] of the val images (stratified by video and positive / negative frames) validated every epoch, 0 = off')
+    parser.add_argument('--full-val-every', type=positive_int, default=5, help='with --val-subset, validate the full val set every N epochs')
+    parser.add_argument('--val-json', type=str, default='', help='val COCO json for --val-subset (default: <val>/val_ann.json)')
+    parser.add_argument('--val-device', default='',
+                        help='device of --async-val, i.e. 1 (GPU index) or cpu (default: training device, '
+                             'which then holds a second copy of the EMA model)')
     opt = parser.parse_args()
 
     # Set DDP variables
@@ -616,7 +920,14 @@ if __name__ == '__main__':
 
     # DDP mode
     opt.total_batch_size = opt.batch_size
-    device = select_device(opt.device, batch_size=opt.batch_size)
+    if getattr(opt, 'val_device', '') == opt.device:
+        opt.val_device = ''  # the training device (default)
+    if getattr(opt, 'async_val', False) and getattr(opt, 'val_device', '').isdigit():
+        # make the validation GPU visible as the last cuda device, next to the training GPU
+        assert opt.local_rank == -1 and opt.device.isdigit(), '--val-device <gpu> requires --device <gpu> (single GPU)'
+        device = select_device(f'{opt.device},{opt.val_device}')
+    else:
+        device = select_device(opt.device, batch_size=opt.batch_size)
     if opt.local_rank != -1:
         assert torch.cuda.device_count() > opt.local_rank
         torch.cuda.set_device(opt.local_rank)